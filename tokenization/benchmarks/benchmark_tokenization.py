@@ -0,0 +1,222 @@
+"""
+Benchmark the tokenization pipeline (Encoder of tokenizer_apply.py, and writing of indexed datasets)
+on reproducible local corpora, without accessing the Hub.
+
+Example:
+    python benchmarks/benchmark_tokenization.py <<...>>/lucie_tokens_65k/tokenizer --output results.json
+    python benchmarks/benchmark_tokenization.py <<...>>/lucie_tokens_65k/tokenizer --compare results.json
+"""
+
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+_folder = os.path.dirname(os.path.realpath(__file__))
+sys.path = [os.path.dirname(_folder), _folder] + sys.path
+
+import indexed_dataset  # noqa # E402 Module level import not at top of file
+import tokenizer_apply  # noqa # E402 Module level import not at top of file
+from corpora import CORPORA, get_corpus, load_sample  # noqa # E402 Module level import not at top of file
+
+
+def batched(iterable, batch_size):
+    for i in range(0, len(iterable), batch_size):
+        yield iterable[i : i + batch_size]
+
+
+def case_encode(encoder, texts, options):
+    return [encoder.encode(text) for text in texts]
+
+
+def case_encode_batch(encoder, texts, options):
+    return [doc for batch in batched(texts, options.batch_size) for doc in encoder.encode_batch(batch)]
+
+
+def case_encode_json(encoder, lines, options):
+    return [encoder.encode_json(line) for line in lines]
+
+
+def case_encode_json_batch(encoder, lines, options):
+    return [doc for batch in batched(lines, options.batch_size) for doc in encoder.encode_json_batch(batch)]
+
+
+def case_encode_long(encoder, texts, options):
+    return [encoder.encode(text, max_len_at_once=options.max_len_at_once) for text in texts]
+
+
+def case_write(encoder, docs, options):
+    with tempfile.TemporaryDirectory() as folder:
+        prefix = os.path.join(folder, "benchmark")
+        builder = indexed_dataset.make_builder(prefix + ".bin", vocab_size=encoder.tokenizer.vocab_size)
+        for doc, sentence_lens, _ in docs:
+            builder.add_doc(doc["text"], sentence_lens["text"])
+        builder.finalize(prefix + ".idx")
+    return docs
+
+
+CASES = {
+    "encode": case_encode,
+    "encode_batch": case_encode_batch,
+    "encode_json": case_encode_json,
+    "encode_json_batch": case_encode_json_batch,
+    "encode_long": case_encode_long,
+    "write": case_write,
+}
+
+
+def prepare_inputs(case, encoder, texts, options):
+    """
+    Inputs of a benchmark case (prepared before timing).
+    """
+    if case.startswith("encode_json"):
+        return [json.dumps({"text": text}) + "\n" for text in texts]
+    if case == "write":
+        return case_encode_batch(encoder, texts, options)
+    return texts
+
+
+def run_case(case, corpus_name, texts, encoder, options):
+    inputs = prepare_inputs(case, encoder, texts, options)
+    best_time = None
+    for _ in range(options.repeat):
+        tic = time.perf_counter()
+        docs = CASES[case](encoder, inputs, options)
+        elapsed = time.perf_counter() - tic
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    num_tokens = sum(len(doc["text"]) for doc, _, _ in docs)
+    num_bytes = sum(len(text.encode("utf-8")) for text in texts)
+    return {
+        "case": case,
+        "corpus": corpus_name,
+        "docs": len(texts),
+        "tokens": num_tokens,
+        "bytes": num_bytes,
+        "time": round(best_time, 4),
+        "docs_per_sec": round(len(texts) / best_time, 1),
+        "tokens_per_sec": round(num_tokens / best_time, 1),
+        "mb_per_sec": round(num_bytes / best_time / 1024 / 1024, 3),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _run_case(i):
+    # Benchmarks are given by index: forked workers inherit corpora, rather than receiving them serialized
+    return run_case(**all_kwargs[i])
+
+
+def print_results(results, reference=None):
+    columns = ["case", "corpus", "docs", "Mtokens", "MB", "time", "docs/s", "Ktok/s", "MB/s", "RSS(MB)"]
+    if reference:
+        columns.append("speedup")
+        reference = {(r["case"], r["corpus"]): r for r in reference}
+    rows = [columns]
+    for r in results:
+        row = [
+            r["case"],
+            r["corpus"],
+            str(r["docs"]),
+            f"{r['tokens'] / 1e6:.2f}",
+            f"{r['bytes'] / 1024 / 1024:.1f}",
+            f"{r['time']:.2f}s",
+            f"{r['docs_per_sec']:.0f}",
+            f"{r['tokens_per_sec'] / 1000:.1f}",
+            f"{r['mb_per_sec']:.2f}",
+            f"{r['peak_rss_mb']:.0f}",
+        ]
+        if reference:
+            ref = reference.get((r["case"], r["corpus"]))
+            row.append(f"x{r['tokens_per_sec'] / ref['tokens_per_sec']:.2f}" if ref else "-")
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    for row in rows:
+        print("  ".join(v.ljust(w) if i < 2 else v.rjust(w) for i, (v, w) in enumerate(zip(row, widths))))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark tokenization on reproducible local corpora",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("tokenizer", type=str, help="Local folder with a tokenizer (ex: output_folder/tokenizer)")
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES), help="Benchmarks to run")
+    parser.add_argument(
+        "--corpora", nargs="+", default=list(CORPORA), choices=list(CORPORA), help="Generated corpora to use"
+    )
+    parser.add_argument("--sample", nargs="*", default=[], help="Local jsonl or parquet files to sample texts from")
+    parser.add_argument("--sample-size", type=int, default=10_000, help="Number of texts sampled from each file")
+    parser.add_argument("--scale", type=float, default=1.0, help="Scale factor for the size of generated corpora")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for generated corpora")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs of each benchmark (the best is kept)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Batch size (see tokenizer_apply.py)")
+    parser.add_argument("--threads", type=int, default=1, help="Threads for batch tokenization")
+    parser.add_argument(
+        "--max-len-at-once", type=int, default=10_000, help="Threshold of the long-document path (encode_long)"
+    )
+    parser.add_argument("--output", type=str, default=None, help="JSON file where to save results")
+    parser.add_argument("--compare", type=str, default=None, help="JSON file with reference results")
+    parser.add_argument(
+        "--no-isolation",
+        default=False,
+        action="store_true",
+        help="Run all benchmarks in the same process (peak memory is then cumulative)",
+    )
+    options = parser.parse_args()
+
+    args = tokenizer_apply.get_args(
+        [
+            "--tokenizer-name-or-path",
+            options.tokenizer,
+            "--batch-size",
+            str(options.batch_size),
+            "--threads_tokenization",
+            str(options.threads),
+        ]
+    )
+    tic = time.time()
+    tokenizer = tokenizer_apply.build_tokenizer(args)
+    print(f"Loaded tokenizer in {time.time() - tic:.2f}s")
+    encoder = tokenizer_apply.Encoder(args)
+    encoder.initializer(tokenizer)
+
+    corpora = {}
+    for name in options.corpora:
+        tic = time.time()
+        corpora[name] = get_corpus(name, scale=options.scale, seed=options.seed)
+        print(f"Generated {name} ({len(corpora[name])} texts) in {time.time() - tic:.2f}s")
+    for path in options.sample:
+        corpora[os.path.basename(path)] = load_sample(path, max_docs=options.sample_size)
+
+    all_kwargs = [
+        dict(case=case, corpus_name=name, texts=texts, encoder=encoder, options=options)
+        for case in options.cases
+        for name, texts in corpora.items()
+    ]
+
+    results = []
+    for i in range(len(all_kwargs)):
+        if options.no_isolation:
+            result = _run_case(i)
+        else:
+            # Each benchmark runs in a forked process, to measure its own peak memory
+            with multiprocessing.get_context("fork").Pool(1) as pool:
+                result = pool.apply(_run_case, (i,))
+        print(json.dumps(result))
+        results.append(result)
+
+    reference = None
+    if options.compare:
+        with open(options.compare) as f:
+            reference = json.load(f)
+    print()
+    print_results(results, reference)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,157 @@
+"""
+Reproducible corpora to benchmark tokenization offline:
+texts generated with a fixed random seed (English, French, code, and pathological inputs),
+or sampled from local jsonl / parquet files.
+"""
+
+import json
+import random
+
+_WORDS = {
+    "en": (
+        "the of and to in is was for that with as on by he it at from his an were are which this be or has had "
+        "first one their its new after but who not they have her she two been other when there all during into "
+        "school time may years more most only over city some world would where later up such used many can state "
+        "about national out known university united then made"
+    ).split(),
+    "fr": (
+        "le la les de des du un une et est en à au aux que qui dans pour par sur pas plus il elle ils elles été "
+        "être avec ce cette ces son sa ses leur où même très après déjà ça l'on d'un d'une qu'il n'est c'est "
+        "aujourd'hui français française élève année première ville état monde école siècle première œuvre "
+        "« » – ; : ?"
+    ).split(),
+}
+
+_CODE_LINES = [
+    "def {name}({arg}, {arg2}=None):",
+    '    """Return the {name} of {arg}."""',
+    "    if {arg} is None:",
+    "        return {num}",
+    "    for i in range({num}):",
+    "        {arg2} = {arg}[i] * {num} + {arg2}",
+    "    result = {{'{name}': {arg}, 'value': {num}.{num}}}",
+    "    return sorted({arg}, key=lambda x: x[{num}])",
+    "class {Name}({Name}Base):",
+    "    # TODO: handle {name} when {arg} > {num}",
+    "x_{num} = np.zeros(({num}, {num}), dtype=np.float32)",
+    "}}",
+    "for (int {arg} = 0; {arg} < {num}; ++{arg}) {{",
+    '    printf("%d\\n", {arg});',
+]
+
+_IDENTIFIERS = "data value count items index buffer tokens config path name result offset size".split()
+
+
+def generate_text(rng, words, num_words, digit_rate=0.02, newline_rate=0.05):
+    """
+    Random text made of the given words, with punctuation, numbers (unless digit_rate=0) and line breaks.
+    """
+    tokens = []
+    capitalize = True
+    for _ in range(num_words):
+        r = rng.random()
+        if r < digit_rate:
+            word = str(rng.randint(0, 10 ** rng.randint(1, 6)))
+        else:
+            word = rng.choice(words)
+            if capitalize:
+                word = word.capitalize()
+        capitalize = False
+        r = rng.random()
+        if r < newline_rate:
+            word += ".\n"
+            capitalize = True
+        elif r < 4 * newline_rate:
+            word += ". "
+            capitalize = True
+        elif r < 8 * newline_rate:
+            word += ", "
+        else:
+            word += " "
+        tokens.append(word)
+    return "".join(tokens).rstrip()
+
+
+def generate_code(rng, num_lines):
+    lines = []
+    for _ in range(num_lines):
+        name = rng.choice(_IDENTIFIERS)
+        lines.append(
+            rng.choice(_CODE_LINES).format(
+                name=name,
+                Name=name.capitalize(),
+                arg=rng.choice(_IDENTIFIERS),
+                arg2=rng.choice(_IDENTIFIERS),
+                num=rng.randint(0, 4096),
+            )
+        )
+    return "\n".join(lines)
+
+
+def corpus_english(rng, scale):
+    return [generate_text(rng, _WORDS["en"], rng.randint(50, 2000)) for _ in range(int(2000 * scale))]
+
+
+def corpus_french(rng, scale):
+    return [generate_text(rng, _WORDS["fr"], rng.randint(50, 2000)) for _ in range(int(2000 * scale))]
+
+
+def corpus_code(rng, scale):
+    return [generate_code(rng, rng.randint(10, 500)) for _ in range(int(1000 * scale))]
+
+
+def corpus_short_docs(rng, scale):
+    # Many short documents (per-document overheads dominate)
+    return [generate_text(rng, _WORDS["en"] + _WORDS["fr"], rng.randint(1, 10)) for _ in range(int(100_000 * scale))]
+
+
+def corpus_huge_lines(rng, scale):
+    # A few huge documents (several MB), with few line breaks and rare digits
+    return [
+        generate_text(rng, _WORDS["en"], int(500_000 * scale), digit_rate=0.0005, newline_rate=0.0001) for _ in range(4)
+    ]
+
+
+def corpus_digit_free(rng, scale):
+    # Huge documents without any digit (worst case for splitting long documents before digits)
+    return [generate_text(rng, _WORDS["fr"], int(500_000 * scale), digit_rate=0) for _ in range(4)]
+
+
+CORPORA = {
+    "english": corpus_english,
+    "french": corpus_french,
+    "code": corpus_code,
+    "short_docs": corpus_short_docs,
+    "huge_lines": corpus_huge_lines,
+    "digit_free": corpus_digit_free,
+}
+
+
+def get_corpus(name, scale=1.0, seed=0):
+    """
+    Return a list of texts (always the same for a given name, scale and seed).
+    """
+    if name not in CORPORA:
+        raise ValueError(f"Unknown corpus {name} (available: {', '.join(CORPORA)})")
+    return CORPORA[name](random.Random(f"{name}-{seed}"), scale)
+
+
+def load_sample(path, key="text", max_docs=10_000):
+    """
+    Return the first texts of a local jsonl or parquet file.
+    """
+    texts = []
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(columns=[key]):
+            texts += batch.column(0).to_pylist()
+            if len(texts) >= max_docs:
+                break
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                texts.append(json.loads(line)[key])
+                if len(texts) >= max_docs:
+                    break
+    return texts[:max_docs]
@@ -0,0 +1,178 @@
+"""
+Local catalog of the parquet files of the Lucie Training Dataset, to avoid querying the Hub at each startup.
+
+The catalog (a json file, in assets/ by default) contains the revision of the dataset, the names of its configs,
+the list of parquet files (with their size and number of rows), and the parquet files of each config.
+
+To (re)build it:
+    python catalog.py
+"""
+
+import json
+import os
+import time
+
+_folder = os.path.dirname(os.path.realpath(__file__))
+_asset_folder = os.path.join(os.path.dirname(_folder), "assets")
+
+DEFAULT_REPO = "OpenLLM-France/Lucie-Training-Dataset"
+DEFAULT_CATALOG_FILE = os.path.join(_asset_folder, "dataset_catalog.json")
+# To increment when the format changes
+CATALOG_VERSION = 1
+
+
+class DatasetCatalog:
+    def __init__(self, catalog):
+        if catalog.get("version") != CATALOG_VERSION:
+            raise RuntimeError(
+                f"Unsupported version of dataset catalog: {catalog.get('version')} (expected {CATALOG_VERSION})."
+                " Please run: python catalog.py"
+            )
+        self.catalog = catalog
+
+    @property
+    def repo(self):
+        return self.catalog["repo"]
+
+    @property
+    def revision(self):
+        return self.catalog["revision"]
+
+    @property
+    def config_names(self):
+        return self.catalog["config_names"]
+
+    @property
+    def all_parquet_files(self):
+        return self.catalog["parquet_files"]
+
+    def parquet_files(self, config_name):
+        """
+        Return the parquet files of a (normalized) config name,
+        i.e. the files whose path contains "/{config_name}/".
+        """
+        if config_name in self.catalog["configs"]:
+            return self.catalog["configs"][config_name]
+        return [f for f in self.all_parquet_files if "/" + config_name + "/" in f]
+
+    def file_info(self, parquet_file):
+        """
+        Return a dictionary with the size and number of rows of a parquet file (if known).
+        """
+        return self.catalog["files"].get(parquet_file, {})
+
+
+def build_catalog(repo=DEFAULT_REPO, file_info=True, num_threads=16):
+    """
+    Build a catalog from the Hub.
+
+    :param file_info: whether to collect the size and number of rows of each parquet file (reading their metadata)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    import datasets
+    import tqdm
+    from data import file_fingerprint, norm_config_name, open_parquet_file
+
+    builder = datasets.load_dataset_builder(repo)
+    parquet_files = sorted(builder.config.data_files["train"])
+    config_names = list(builder.builder_configs)
+
+    revisions = sorted({f.split("@", 1)[1].split("/", 1)[0] for f in parquet_files if "@" in f})
+    assert len(revisions) <= 1, f"Several revisions: {revisions}"
+
+    configs = {}
+    for name in config_names:
+        c = norm_config_name(name)
+        configs[c] = [f for f in parquet_files if "/" + c + "/" in f]
+
+    def get_file_info(parquet_file):
+        with open_parquet_file(parquet_file) as pf:
+            metadata = pf.metadata
+        return parquet_file, {
+            "size": file_fingerprint(parquet_file).get("size"),
+            "num_rows": metadata.num_rows,
+            "num_row_groups": metadata.num_row_groups,
+        }
+
+    files = {}
+    if file_info:
+        with ThreadPoolExecutor(num_threads) as executor:
+            for parquet_file, info in tqdm.tqdm(
+                executor.map(get_file_info, parquet_files), total=len(parquet_files), desc="Reading metadata"
+            ):
+                files[parquet_file] = info
+
+    return {
+        "version": CATALOG_VERSION,
+        "repo": repo,
+        "revision": revisions[0] if revisions else None,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config_names": config_names,
+        "parquet_files": parquet_files,
+        "configs": configs,
+        "files": files,
+    }
+
+
+def save_catalog(catalog, filename=DEFAULT_CATALOG_FILE):
+    os.makedirs(os.path.dirname(os.path.realpath(filename)), exist_ok=True)
+    with open(filename + ".tmp", "w", encoding="utf8") as f:
+        json.dump(catalog, f, indent=1, ensure_ascii=False)
+    os.replace(filename + ".tmp", filename)
+
+
+_catalogs = {}
+
+
+def get_catalog(filename=None):
+    """
+    Return the catalog of the dataset (loaded once per process).
+    The catalog is built from the Hub (and saved) only if the file does not exist.
+    """
+    if filename is None:
+        filename = os.environ.get("LUCIE_DATASET_CATALOG", DEFAULT_CATALOG_FILE)
+    if filename not in _catalogs:
+        if os.path.isfile(filename):
+            with open(filename, encoding="utf8") as f:
+                catalog = json.load(f)
+        else:
+            print(f"Building dataset catalog {filename} (from the Hub)...")
+            catalog = build_catalog(file_info=False)
+            save_catalog(catalog, filename)
+        _catalogs[filename] = DatasetCatalog(catalog)
+    return _catalogs[filename]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Build (or refresh) the local catalog of the parquet files of the dataset",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--output", type=str, default=DEFAULT_CATALOG_FILE, help="Catalog file")
+    parser.add_argument("--repo", type=str, default=DEFAULT_REPO, help="Dataset repository on the Hub")
+    parser.add_argument(
+        "--skip-file-info",
+        default=False,
+        action="store_true",
+        help="Do not collect the size and number of rows of each parquet file",
+    )
+    parser.add_argument("--threads", type=int, default=16, help="Number of threads to read metadata of parquet files")
+    args = parser.parse_args()
+
+    tic = time.time()
+    catalog = build_catalog(args.repo, file_info=not args.skip_file_info, num_threads=args.threads)
+
+    if os.path.isfile(args.output):
+        with open(args.output, encoding="utf8") as f:
+            old_files = set(json.load(f).get("parquet_files", []))
+        new_files = set(catalog["parquet_files"])
+        print(f"{len(new_files - old_files)} parquet files added, {len(old_files - new_files)} removed")
+
+    save_catalog(catalog, args.output)
+    print(
+        f"Wrote {args.output}: revision {catalog['revision']}, {len(catalog['config_names'])} configs,"
+        f" {len(catalog['parquet_files'])} parquet files (in {time.time() - tic:.0f}s)"
+    )
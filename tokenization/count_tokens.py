@@ -1,15 +1,10 @@
 import json
 import os
-import sys
 
+import indexed_dataset
+import numpy as np
 import tqdm
 
-rootdir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-megatron_deepspeed_folder = os.path.join(rootdir, "Megatron-DeepSpeed")
-sys.path = [megatron_deepspeed_folder] + sys.path  # Better to prepend for "tools" module
-
-from megatron.data import indexed_dataset  # noqa # E402 Module level import not at top of file
-
 
 def get_name(dataset):
     name = os.path.basename(dataset)
@@ -21,8 +16,66 @@ def get_name(dataset):
     return name
 
 
+def compute_stats(path, histogram=False):
+    """
+    Compute statistics about the number of tokens in an indexed dataset,
+    using only the sizes stored in the index (*.idx file), without reading the tokens (*.bin file).
+
+    :param path: Indexed dataset (filename without extension)
+    :param histogram: Also compute percentiles and an histogram of the number of tokens per sequence
+        (in the histogram, the count for key N is the number of sequences with more than N/2 and at most N tokens)
+    """
+    index = indexed_dataset.MMapIndexedDataset.Index(indexed_dataset.index_file_path(path))
+    sizes = index.sizes
+    stats = {
+        "total_tokens": int(sizes.sum(dtype=np.int64)),
+        "total_sequences": len(sizes),
+        "min_tokens": int(sizes.min()) if len(sizes) else 0,
+        "max_tokens": int(sizes.max()) if len(sizes) else 0,
+    }
+    if histogram and len(sizes):
+        percentiles = [1, 5, 10, 25, 50, 75, 90, 95, 99]
+        stats["percentiles_tokens"] = {
+            f"p{p}": int(v) for p, v in zip(percentiles, np.percentile(sizes, percentiles, method="nearest"))
+        }
+        # Bin i contains sizes in ]2^(i-1), 2^i] (and bin 0 contains sizes 0 and 1)
+        bins = np.ceil(np.log2(np.maximum(sizes, 1))).astype(np.int64)
+        stats["histogram_tokens"] = {str(2**i): int(n) for i, n in enumerate(np.bincount(bins)) if n}
+    return stats
+
+
+def count_tokens(path, histogram=False, save_in_json=True):
+    """
+    Return the total number of tokens in an indexed dataset, and whether it was computed (or read from a json file).
+    """
+    json_file = path + ".json" if save_in_json else None
+    if json_file and os.path.exists(json_file):
+        try:
+            with open(json_file) as f:
+                total_tokens = json.load(f)["total_tokens"]
+        except Exception:
+            # print(f"Error reading {json_file}: {e}")
+            total_tokens = 0
+        return total_tokens, False
+
+    if json_file:
+        # Create empty file
+        with open(json_file, "w") as f:
+            pass
+    stats = compute_stats(path, histogram=histogram)
+    if json_file:
+        with open(json_file, "w") as f:
+            json.dump(stats, f, indent=4)
+    return stats["total_tokens"], True
+
+
+def _count_tokens(kwargs):
+    return count_tokens(**kwargs)
+
+
 if __name__ == "__main__":
     import argparse
+    import multiprocessing
 
     parser = argparse.ArgumentParser(
         description="Count tokens in indexed datasets",
@@ -35,6 +88,13 @@ if __name__ == "__main__":
         # default="/data-storage/storage0/lucie_tokens_65k",
         # nargs="?",
     )
+    parser.add_argument(
+        "--histogram",
+        default=False,
+        action="store_true",
+        help="Also compute percentiles and histogram of the number of tokens per sequence",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Number of files processed in parallel")
     args = parser.parse_args()
 
     folder = args.folder
@@ -50,55 +110,29 @@ if __name__ == "__main__":
         path = os.path.join(folder, os.path.splitext(file)[0])
         paths.append(path)
 
+    paths = sorted(paths)
+    all_kwargs = [dict(path=path, histogram=args.histogram, save_in_json=save_in_json) for path in paths]
+
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers)
+        results = pool.imap(_count_tokens, all_kwargs)
+    else:
+        pool = None
+        results = map(_count_tokens, all_kwargs)
+
     num_done = 0
 
-    for path in tqdm.tqdm(sorted(paths)):
+    for path, (total_tokens, done) in zip(paths, tqdm.tqdm(results, total=len(paths))):
         name = get_name(path)
-        json_file = None
-        if save_in_json:
-            json_file = path + ".json"
-        if json_file and os.path.exists(json_file):
-            try:
-                data = json.load(open(json_file))
-                total_tokens = data["total_tokens"]
-                total_sequences = data["total_sequences"]
-                min_tokens = data["min_tokens"]
-                max_tokens = data["max_tokens"]
-            except Exception:
-                # print(f"Error reading {json_file}: {e}")
-                total_tokens = 0
-        else:
-            if save_in_json:
-                # Create empty file
-                with open(json_file, "w") as f:
-                    pass
-            dataset = indexed_dataset.MMapIndexedDataset(path)
-            total_tokens = 0
-            total_sequences = 0
-            min_tokens = 1e32
-            max_tokens = 0
-            for data in dataset:
-                n = len(data)
-                total_tokens += n
-                min_tokens = min(min_tokens, n)
-                max_tokens = max(max_tokens, n)
-                total_sequences += 1
-            if json_file and save_in_json:
-                json.dump(
-                    {
-                        "total_tokens": total_tokens,
-                        "total_sequences": total_sequences,
-                        "min_tokens": min_tokens,
-                        "max_tokens": max_tokens,
-                    },
-                    open(json_file, "w"),
-                    indent=4,
-                )
-            num_done += 1
+        num_done += int(done)
 
         total_num_tokens["TOTAL"] = total_num_tokens.get("TOTAL", 0) + total_tokens
         total_num_tokens[name] = total_num_tokens.get(name, 0) + total_tokens
 
+    if pool is not None:
+        pool.close()
+        pool.join()
+
     for k in total_num_tokens:
         total_num_tokens[k] /= 1e9
 
@@ -1,12 +1,20 @@
+import contextlib
 import itertools
 import json
 import os
+import queue
 import re
+import threading
 import time
 from collections.abc import Generator
 
 import datasets
+import fsspec
+import numpy as np
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import tqdm
+from catalog import get_catalog
 
 _folder = os.path.dirname(os.path.realpath(__file__))
 _asset_folder = os.path.join(os.path.dirname(_folder), "assets")
@@ -36,6 +44,10 @@ def decompose_datasets(dataset, **kwargs):
         for it in dataset:
             yield from decompose_datasets(it, **kwargs)  # Recursion
         return
+    elif isinstance(dataset, (LazyDataIterator, ParquetDataIterator)):
+        # Already decomposed
+        yield dataset
+        return
     else:
         config_name = norm_config_name(dataset.config_name)
     yield from decompose_config(config_name, **kwargs)
@@ -73,9 +85,18 @@ def norm_config_name(name):
     return nname
 
 
-def decompose_config(config_names=None, streaming=True, high_quality=False, **kwargs):
-    config = datasets.load_dataset_builder("OpenLLM-France/Lucie-Training-Dataset")
-    parquet_files = config.config.data_files["train"]
+def decompose_config(config_names=None, streaming=True, high_quality=False, lazy=False, data_folder=None, **kwargs):
+    """
+    Yield one dataset per parquet file of the given config(s).
+
+    With lazy=True, datasets are only described (name and parquet file), and opened when they are used
+    (see LazyDataIterator).
+    Parquet files are read with pyarrow rather than datasets (see ParquetDataIterator),
+    from the Hub (hf:// paths, opened with huggingface_hub.HfFileSystem, which uses the token of the user),
+    or from a local copy of the dataset repository (data_folder/data/...) if data_folder is given.
+    Parquet files are listed from the local catalog of the dataset (see catalog.py).
+    """
+    catalog = get_catalog()
 
     if config_names is None:
         config_names = get_all_config_names(allow_subset=False)
@@ -87,21 +108,22 @@ def decompose_config(config_names=None, streaming=True, high_quality=False, **kw
     for c in config_names:
         c = norm_config_name(c)
         has_found_parquet = False
-        for parquet_file in sorted(parquet_files):
-            if "/" + c + "/" in parquet_file:
-                has_found_parquet = True
-                if "v1.1" in parquet_file:
-                    assert parquet_file not in all_parquets_v1, f"Multiple config for {parquet_file}"
-                    all_parquets_v1.append(parquet_file)
-                else:
-                    assert parquet_file not in all_parquets_latest, f"Multiple config for {parquet_file}"
-                    all_parquets_latest.append(parquet_file)
+        for parquet_file in sorted(catalog.parquet_files(c)):
+            has_found_parquet = True
+            if "v1.1" in parquet_file:
+                assert parquet_file not in all_parquets_v1, f"Multiple config for {parquet_file}"
+                all_parquets_v1.append(parquet_file)
+            else:
+                assert parquet_file not in all_parquets_latest, f"Multiple config for {parquet_file}"
+                all_parquets_latest.append(parquet_file)
         if high_quality and len(all_parquets_latest) > 0:
             all_parquets = all_parquets_latest
         else:
             all_parquets = all_parquets_v1
         print(f"Found {len(all_parquets)} parquets for config '{c}' ({high_quality=})")
-        assert has_found_parquet, f"Cannot find parquet for config '{c}' (parquet_files={parquet_files[:5]})"
+        assert (
+            has_found_parquet
+        ), f"Cannot find parquet for config '{c}' (parquet_files={catalog.all_parquet_files[:5]})"
 
     for parquet_files in sorted(all_parquets):
         if isinstance(parquet_files, str):
@@ -109,20 +131,20 @@ def decompose_config(config_names=None, streaming=True, high_quality=False, **kw
         for parquet_file in parquet_files:
             name, _ = os.path.splitext(parquet_file)
             name = "--".join(name.split("/")[-5:])
-            # Change from           hf://datasets/OpenLLM-France/Lucie-Training-Dataset@f3dff6f941eecc0c0a57dc0579610355a98d7c9c/data/XXX
-            # to  https://huggingface.co/datasets/OpenLLM-France/Lucie-Training-Dataset/resolve/f3dff6f941eecc0c0a57dc0579610355a98d7c9c/data/XXX
-            parquet_file = parquet_file.replace("hf://", "https://huggingface.co/").replace("@", "/resolve/")
+            # Paths are like hf://datasets/OpenLLM-France/Lucie-Training-Dataset@f3dff6f941eecc0c0a57dc0579610355a98d7c9c/data/XXX
+            if data_folder:
+                # Path in the repository (after "hf://datasets/OpenLLM-France/Lucie-Training-Dataset@{revision}/")
+                parquet_file = os.path.join(data_folder, parquet_file.split("@", 1)[1].split("/", 1)[1])
+                assert os.path.isfile(parquet_file), f"Missing local file {parquet_file}"
+            if lazy:
+                yield LazyDataIterator(name, [parquet_file], streaming=streaming, **kwargs)
+                continue
             print(f"Loading {parquet_file} -> '{name}'")
-            yield DataIterator(
-                datasets.load_dataset("parquet", data_files=parquet_file, streaming=streaming, split="train", **kwargs),
-                name=name,
-            )
+            yield ParquetDataIterator(parquet_file, name=name)
 
 
 def get_all_config_names(allow_subset=False):
-    config = datasets.load_dataset_builder("OpenLLM-France/Lucie-Training-Dataset")
-
-    config_names = list(config.builder_configs)
+    config_names = list(get_catalog().config_names)
 
     def include_config_name(all_names, name):
         _languages = ["fr", "en", "de", "es", "it"]
@@ -166,6 +188,7 @@ class DataIterator:
         num_words=None,
         streaming=True,
         name=None,
+        parquet_files=None,
         **kwargs,
     ):
         revision = "v1.2" if high_quality else None  # "v1.1"
@@ -194,14 +217,31 @@ class DataIterator:
             self.config_name = name
 
         self.dataset_iter = self.hf_dataset.__iter__()
-        self.max_num_words = max_num_words
-        self.skip_number = (int(num_words / max_num_words) - 1) if num_words and max_num_words else 0
         self.streaming = streaming
         self.given_name = name
         self.key = "text"
+        if parquet_files is not None:
+            self.parquet_files = parquet_files
+        elif not hasattr(self, "parquet_files"):
+            self.parquet_files = None
+            if repo == "parquet" and isinstance(config_name, str):
+                # Local or Hub parquet files (ex: DataIterator("default", "parquet", data_files=[...]))
+                data_files = kwargs.get("data_files")
+                data_files = [data_files] if isinstance(data_files, str) else data_files
+                if isinstance(data_files, list) and data_files and all(map(can_read_parquet_file, data_files)):
+                    self.parquet_files = data_files
+        if max_num_words and not num_words and self.parquet_files:
+            # Use the number of words computed by "python data.py --workers N" (if available)
+            num_words = cached_num_words(self.parquet_files, self.key)
+        self.max_num_words = max_num_words
+        self.skip_number = (int(num_words / max_num_words) - 1) if num_words and max_num_words else 0
 
     def __iter__(self):
         self.num_words_passed = 0
+        if self.parquet_files and isinstance(self.key, str):
+            # Read parquet files directly: skipped documents are not decoded,
+            # and words are counted by batches (see ParquetDataIterator)
+            return iter(self.parquet_iterator())
         return self
 
     def __next__(self):
@@ -221,6 +261,41 @@ class DataIterator:
             return self.given_name
         return self.config_name
 
+    def can_shard(self) -> bool:
+        return bool(self.parquet_files) and isinstance(self.key, str) and not self.max_num_words
+
+    def shard(self, num_shards, index):
+        """
+        Return an iterator on a part of the data (contiguous parquet row groups),
+        such that iterating on the num_shards shards in order gives the same documents as iterating on the whole data.
+        """
+        assert self.can_shard(), f"Cannot shard {self.name}"
+        return self.parquet_iterator(num_shards=num_shards, shard_index=index)
+
+    def parquet_iterator(self, **kwargs):
+        return ParquetDataIterator(
+            self.parquet_files,
+            name=self.name,
+            key=self.key,
+            skip_number=self.skip_number,
+            max_num_words=self.max_num_words,
+            **kwargs,
+        )
+
+    def fingerprint(self) -> dict:
+        """
+        Description of the data (json serializable), that changes when the data changes (when it can be known).
+        """
+        fingerprint = {"name": self.name}
+        if self.parquet_files and isinstance(self.key, str):
+            fingerprint.update(
+                files=[file_fingerprint(f) for f in self.parquet_files],
+                key=self.key,
+                skip_number=self.skip_number,
+                max_num_words=self.max_num_words,
+            )
+        return fingerprint
+
 
 class DataIteratorFromList:
     def __init__(self, list_of_iterators, name):
@@ -243,6 +318,332 @@ class DataIteratorFromList:
             return self.__next__()
 
 
+class LazyDataIterator:
+    """
+    Description of a dataset made of parquet files (name and how to open it),
+    that is cheap to create and to send to another process.
+    The dataset is only opened when it is iterated (or when open() is called),
+    and shards are read directly from parquet files (without opening a datasets.IterableDataset).
+    """
+
+    def __init__(self, name, parquet_files, streaming=True, key="text", **kwargs):
+        self.name = name
+        self.parquet_files = parquet_files
+        self.streaming = streaming
+        self.key = key
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return self.name
+
+    def open(self):
+        print(f"Loading {self.parquet_files[0]} -> '{self.name}'")
+        if self.can_shard():
+            # Local and Hub files are read directly with pyarrow
+            return ParquetDataIterator(self.parquet_files, name=self.name, key=self.key)
+        return DataIterator(
+            datasets.load_dataset(
+                "parquet", data_files=self.parquet_files, streaming=self.streaming, split="train", **self.kwargs
+            ),
+            name=self.name,
+            parquet_files=self.parquet_files,
+        )
+
+    def __iter__(self):
+        return iter(self.open())
+
+    def can_shard(self) -> bool:
+        return all(map(can_read_parquet_file, self.parquet_files))
+
+    def shard(self, num_shards, index):
+        assert self.can_shard(), f"Cannot shard {self.name}"
+        return ParquetDataIterator(
+            self.parquet_files, name=self.name, key=self.key, num_shards=num_shards, shard_index=index
+        )
+
+    def fingerprint(self) -> dict:
+        # Same as DataIterator.fingerprint() of the opened dataset
+        return {
+            "name": self.name,
+            "files": [file_fingerprint(f) for f in self.parquet_files],
+            "key": self.key,
+            "skip_number": 0,
+            "max_num_words": None,
+        }
+
+
+class ParquetDataIterator:
+    """
+    Iterate over the texts of parquet files, reading row groups directly with pyarrow.
+
+    When num_shards > 1, only a contiguous part of the row groups is read (the shard number shard_index).
+    With prefetch > 0, the next row groups (at most prefetch) are read in a background thread,
+    while the texts of the current one are processed.
+    skip_number and max_num_words have the same meaning as in DataIterator (subsampling, and budget of words):
+    row groups without any selected document are not read, only selected documents are converted to python strings,
+    and words are counted by batches.
+    """
+
+    def __init__(
+        self,
+        parquet_files,
+        name,
+        key="text",
+        num_shards=1,
+        shard_index=0,
+        batch_size=1024,
+        prefetch=2,
+        skip_number=0,
+        max_num_words=None,
+    ):
+        assert 0 <= shard_index < num_shards
+        if isinstance(parquet_files, str):
+            parquet_files = [parquet_files]
+        self.parquet_files = parquet_files
+        self.name = name
+        self.key = key
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.skip_number = skip_number
+        self.max_num_words = max_num_words
+
+    def __str__(self):
+        if self.num_shards == 1:
+            return self.name
+        return f"{self.name} (part {self.shard_index+1}/{self.num_shards})"
+
+    def __len__(self):
+        # Number of selected documents (read from the metadata only, and regardless of max_num_words)
+        return sum(
+            len(self.selected_rows(first_row, num_rows)) for _, _, first_row, num_rows in self.shard_row_groups()
+        )
+
+    def can_shard(self) -> bool:
+        return self.num_shards == 1 and not self.max_num_words
+
+    def shard(self, num_shards, index):
+        """
+        Return an iterator on a part of the row groups (for instance, for one of several workers).
+        """
+        assert self.can_shard(), f"Cannot shard {self}"
+        return ParquetDataIterator(
+            self.parquet_files,
+            name=self.name,
+            key=self.key,
+            num_shards=num_shards,
+            shard_index=index,
+            batch_size=self.batch_size,
+            prefetch=self.prefetch,
+            skip_number=self.skip_number,
+        )
+
+    def all_row_groups(self):
+        """
+        Return the list of (parquet_file, row_group, first_row, num_rows) for all the row groups of the parquet files,
+        where first_row is the index of the first row of the row group (in the concatenation of all the files).
+        """
+        all_row_groups = []
+        first_row = 0
+        for parquet_file in self.parquet_files:
+            with open_parquet_file(parquet_file) as pf:
+                for i in range(pf.num_row_groups):
+                    num_rows = pf.metadata.row_group(i).num_rows
+                    all_row_groups.append((parquet_file, i, first_row, num_rows))
+                    first_row += num_rows
+        return all_row_groups
+
+    def shard_row_groups(self):
+        """
+        Return the list of (parquet_file, row_group, first_row, num_rows) to read in this shard
+        """
+        all_row_groups = self.all_row_groups()
+        n = len(all_row_groups)
+        return all_row_groups[self.shard_index * n // self.num_shards : (self.shard_index + 1) * n // self.num_shards]
+
+    def row_groups(self):
+        """
+        Return the list of (parquet_file, row_groups) to read in this shard
+        """
+        row_groups = {}
+        for parquet_file, i, _, _ in self.shard_row_groups():
+            row_groups.setdefault(parquet_file, []).append(i)
+        return list(row_groups.items())
+
+    def selected_rows(self, first_row, num_rows):
+        """
+        Indices (in a row group) of the selected rows: the last one of every skip_number + 1 rows, as in DataIterator.
+        """
+        step = self.skip_number + 1
+        return range((-first_row - 1) % step, num_rows, step)
+
+    def iter_row_groups(self):
+        """
+        Iterate over the text column of the (selected rows of) row groups of this shard (pyarrow arrays).
+        """
+        row_groups = {}
+        for parquet_file, i, first_row, num_rows in self.shard_row_groups():
+            rows = self.selected_rows(first_row, num_rows)
+            if len(rows):
+                row_groups.setdefault(parquet_file, []).append((i, rows))
+        for parquet_file, file_row_groups in row_groups.items():
+            with open_parquet_file(parquet_file) as pf:
+                for i, rows in file_row_groups:
+                    texts = pf.read_row_group(i, columns=[self.key]).column(0)
+                    if len(rows) < len(texts):
+                        texts = texts.take(np.arange(rows.start, rows.stop, rows.step))
+                    yield texts
+
+    def iter_batches(self, batch_size=None):
+        """
+        Iterate over lists of (at most) batch_size texts.
+        Only the text column is read, and converted to python strings once per batch.
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        all_texts = self.iter_row_groups()
+        if self.prefetch:
+            all_texts = prefetch_iterator(all_texts, self.prefetch)
+        num_words = 0
+        for texts in all_texts:
+            if self.max_num_words:
+                # Stop before the first document that exceeds the budget of words
+                words = pc.fill_null(pc.count_substring_regex(texts, _WORD_REGEX), 0).to_numpy()
+                cumulated_words = num_words + np.cumsum(words)
+                num_docs = int(np.searchsorted(cumulated_words, self.max_num_words, side="right"))
+                if num_docs < len(texts):
+                    texts = texts.slice(0, num_docs)
+                num_words = cumulated_words[-1] if len(cumulated_words) else num_words
+            for start in range(0, len(texts), batch_size):
+                yield texts.slice(start, batch_size).to_pylist()
+            if self.max_num_words and num_words > self.max_num_words:
+                return
+
+    def __iter__(self):
+        for texts in self.iter_batches():
+            yield from texts
+
+    def fingerprint(self) -> dict:
+        """
+        Description of the data (json serializable), that changes when the data or the part changes.
+        """
+        fingerprint = {
+            "name": self.name,
+            "files": [file_fingerprint(f) for f in self.parquet_files],
+            "key": self.key,
+            "shard": [self.shard_index, self.num_shards],
+        }
+        if self.skip_number or self.max_num_words:
+            fingerprint.update(skip_number=self.skip_number, max_num_words=self.max_num_words)
+        return fingerprint
+
+
+def prefetch_iterator(iterator, size):
+    """
+    Iterate over the items of an iterator that are produced in a background thread (at most size items in advance).
+    Exceptions raised in the background thread are raised again when the corresponding item is expected.
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put((True, item)):
+                    return
+        except BaseException as err:
+            put((False, err))
+            return
+        put((False, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            is_item, item = items.get()
+            if not is_item:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        # When iteration is stopped early, stop the background thread too
+        stop.set()
+        thread.join()
+
+
+def can_read_parquet_file(path):
+    """
+    Return whether a parquet file can be read with open_parquet_file(): local files, and files of the Hub (hf:// paths).
+    Other remote files are left to the datasets library.
+    """
+    return path.startswith("hf://") or os.path.isfile(path)
+
+
+@contextlib.contextmanager
+def open_parquet_file(path):
+    """
+    Open a local parquet file, or a parquet file of the Hub (only the metadata is read at this point).
+
+    hf:// paths (ex: hf://datasets/{repo}@{revision}/{path}) are opened with huggingface_hub.HfFileSystem,
+    which sends the token of the user (for gated or private datasets) and retries failed requests.
+    """
+    with fsspec.open(path, "rb") as f:
+        pf = pq.ParquetFile(f)
+        try:
+            yield pf
+        finally:
+            pf.close()
+
+
+def cached_num_words(parquet_files, key="text", folder=None):
+    """
+    Return the total number of words in parquet files, from the cache of statistics of compute_stats_parallel()
+    (in assets/stats_raw by default), or None if it is not known for all the files.
+    """
+    if folder is None:
+        folder = os.path.join(_asset_folder, "stats_raw")
+    cache_filename = os.path.join(folder, "stats_cache.json")
+    if not os.path.isfile(cache_filename):
+        return None
+    with open(cache_filename, encoding="utf8") as f:
+        cache = json.load(f)
+    num_words = 0
+    for parquet_file in parquet_files:
+        cached = cache.get(f"{parquet_file}:{key}")
+        if not cached or "num words" not in cached["stats"]:
+            return None
+        if os.path.isfile(parquet_file) and cached["fingerprint"] != file_fingerprint(parquet_file):
+            # Local file was modified
+            return None
+        num_words += cached["stats"]["num words"]
+    return num_words
+
+
+def file_fingerprint(path):
+    """
+    Metadata that identifies the version of a local or remote file (size, and modification time or ETag if available).
+    """
+    fs, fs_path = fsspec.core.url_to_fs(path)
+    info = fs.info(fs_path)
+    fingerprint = {"path": path}
+    for key in ["size", "mtime", "blob_id", "ETag", "etag", "last_modified", "LastModified"]:
+        if info.get(key) is not None:
+            value = info[key]
+            fingerprint[key] = value if isinstance(value, (int, float, str)) else str(value)
+    return fingerprint
+
+
 ########################################
 # Main
 
@@ -262,6 +663,12 @@ def main():
         help="Which dataset to test",
     )
     parser.add_argument("--high-quality", default=False, action="store_true", help="Use lastly curated data")
+    parser.add_argument(
+        "--data-folder",
+        type=str,
+        default=None,
+        help="Local copy of the dataset repository, where parquet files are read from (instead of the Hub)",
+    )
     parser.add_argument(
         "--folder",
         type=str,
@@ -298,12 +705,34 @@ def main():
         default=False,
         help="Only dump long examples (more than 50k words)",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes to compute statistics in parallel (on parquet row groups),"
+        " with a cache of statistics per parquet file in the output folder",
+    )
     args = parser.parse_args()
 
     if args.folder:
         os.makedirs(args.folder, exist_ok=True)
         shutil.copy2(__file__, os.path.join(args.folder, os.path.basename(__file__)))
 
+    if args.workers > 1 and not (args.only_dump_examples or args.long_examples or args.max_examples):
+        # Datasets are only described (parquet files), and read by the workers
+        all_datasets = [
+            get_datasets(name, high_quality=args.high_quality, lazy=True, data_folder=args.data_folder)
+            for name in args.dataset
+        ]
+        compute_stats_parallel(
+            list(decompose_datasets(all_datasets)),
+            folder=args.folder,
+            num_workers=args.workers,
+            ignore_if_exists=args.ignore_if_exists,
+            num_examples=args.num_examples,
+        )
+        return
+
     def remove_common_prefix(main, sub):
         common_prefix = os.path.commonprefix([main, sub])
         return sub[len(common_prefix) :]
@@ -315,7 +744,9 @@ def main():
             global_stats[k] += v
 
     # Data loading
-    all_datasets = [get_datasets(name, high_quality=args.high_quality) for name in args.dataset]
+    all_datasets = [
+        get_datasets(name, high_quality=args.high_quality, data_folder=args.data_folder) for name in args.dataset
+    ]
     # Split: dataset -> (parquet) subsets
     all_datasets = [list(decompose_datasets(ds)) for ds in all_datasets]
     # Flatten
@@ -494,6 +925,136 @@ def test_iterator(
     return stats
 
 
+# Words are sequences of characters that are not whitespaces (as with str.split())
+_WHITESPACES = "".join(c for c in map(chr, range(0x3001)) if c.isspace())
+_WORD_REGEX = "[^" + "".join(f"\\x{{{ord(c):x}}}" for c in _WHITESPACES) + "]+"
+
+
+def count_words_and_chars(texts):
+    """
+    Return the number of words (as with str.split()) and characters in a pyarrow array of texts,
+    using pyarrow compute kernels (without converting texts to python strings).
+    """
+    num_words = pc.sum(pc.count_substring_regex(texts, _WORD_REGEX)).as_py() or 0
+    num_chars = pc.sum(pc.utf8_length(texts)).as_py() or 0
+    return num_words, num_chars
+
+
+def _parquet_file_info(parquet_file):
+    with open_parquet_file(parquet_file) as pf:
+        num_row_groups = pf.num_row_groups
+    return parquet_file, file_fingerprint(parquet_file), num_row_groups
+
+
+def _row_group_stats(work_item):
+    parquet_file, key, row_group = work_item
+    tic = time.time()
+    with open_parquet_file(parquet_file) as pf:
+        texts = pf.read_row_group(row_group, columns=[key]).column(0)
+    num_words, num_chars = count_words_and_chars(texts)
+    stats = {
+        "time to iterate (sec)": time.time() - tic,
+        "num pages": len(texts),
+        "num words": num_words,
+        "num chars": num_chars,
+    }
+    return parquet_file, key, stats
+
+
+def compute_stats_parallel(all_datasets, folder=None, num_workers=1, ignore_if_exists=False, num_examples=0):
+    """
+    Compute the same statistics as test_iterator(), for datasets described by LazyDataIterator,
+    processing the row groups of all their parquet files in a pool of processes.
+
+    Statistics of each parquet file are cached in {folder}/stats_cache.json along with the fingerprint of the file,
+    so that only new (or modified) files are processed when running again.
+    "time to iterate (sec)" is then the total time spent by workers on the row groups.
+    """
+    import multiprocessing
+
+    def add_stats(global_stats, stats):
+        for k, v in stats.items():
+            global_stats[k] = global_stats.get(k, 0) + v
+
+    cache_filename = os.path.join(folder, "stats_cache.json") if folder else None
+    cache = {}
+    if cache_filename and os.path.isfile(cache_filename):
+        with open(cache_filename, encoding="utf8") as f:
+            cache = json.load(f)
+
+    todo = []
+    for it in all_datasets:
+        assert isinstance(it, LazyDataIterator), f"Cannot compute stats in parallel for {it}"
+        name_slug = simple_slugify(it.name)
+        stat_filename = os.path.join(folder, f"stats_{name_slug}.json") if folder else None
+        if ignore_if_exists and stat_filename and os.path.isfile(stat_filename):
+            print(f"Skipping {name_slug} (already computed)")
+            continue
+        todo.append((it, stat_filename))
+        if num_examples and folder:
+            example_folder = os.path.join(folder, "examples")
+            os.makedirs(example_folder, exist_ok=True)
+            for i, text in enumerate(itertools.islice(it.shard(num_shards=1, index=0), num_examples)):
+                filename = os.path.join(example_folder, name_slug)
+                if num_examples > 1:
+                    filename += f"_{i:02d}"
+                with open(filename + ".txt", "w", encoding="utf8") as f:
+                    f.write(text + "\n")
+
+    parquet_files = sorted({parquet_file for it, _ in todo for parquet_file in it.parquet_files})
+    keys = {}
+    for it, _ in todo:
+        for parquet_file in it.parquet_files:
+            keys.setdefault(parquet_file, set()).add(it.key)
+
+    # Statistics of each (parquet_file, key)
+    file_stats = {}
+    fingerprints = {}
+    work_items = []
+    num_cached = 0
+    with multiprocessing.Pool(num_workers) as pool:
+        for parquet_file, fingerprint, num_row_groups in tqdm.tqdm(
+            pool.imap_unordered(_parquet_file_info, parquet_files), total=len(parquet_files), desc="Reading metadata"
+        ):
+            for key in keys[parquet_file]:
+                fingerprints[parquet_file, key] = fingerprint
+                cached = cache.get(f"{parquet_file}:{key}")
+                if cached and cached["fingerprint"] == fingerprint:
+                    file_stats[parquet_file, key] = cached["stats"]
+                    num_cached += 1
+                else:
+                    file_stats[parquet_file, key] = {}
+                    work_items += [(parquet_file, key, row_group) for row_group in range(num_row_groups)]
+
+        print(f"{num_cached}/{len(file_stats)} parquet files in cache, {len(work_items)} row groups to process")
+
+        for parquet_file, key, stats in tqdm.tqdm(
+            pool.imap_unordered(_row_group_stats, work_items), total=len(work_items), desc="Computing stats"
+        ):
+            add_stats(file_stats[parquet_file, key], stats)
+
+    if cache_filename:
+        for (parquet_file, key), stats in file_stats.items():
+            cache[f"{parquet_file}:{key}"] = {"fingerprint": fingerprints[parquet_file, key], "stats": stats}
+        with open(cache_filename + ".tmp", "w", encoding="utf8") as f:
+            json.dump(cache, f, indent=2, ensure_ascii=False)
+        os.replace(cache_filename + ".tmp", cache_filename)
+
+    all_stats = {}
+    for it, stat_filename in todo:
+        stats = {}
+        for parquet_file in it.parquet_files:
+            add_stats(stats, file_stats[parquet_file, it.key])
+        if not stats.get("num pages"):
+            raise RuntimeError(f"No page found in {it.name}")
+        print(f"* {it.name}")
+        print(json.dumps(stats, indent=4))
+        if stat_filename:
+            json.dump(stats, open(stat_filename, "w", encoding="utf8"), indent=2, ensure_ascii=False)
+        all_stats[it.name] = stats
+    return all_stats
+
+
 def simple_slugify(name):
     return re.sub(r"[ :/]", "--", name).strip("_-")
 
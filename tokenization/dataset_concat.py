@@ -2,18 +2,80 @@ import json
 import os
 import re
 import shutil
-import sys
 
+import indexed_dataset
 import tqdm
+from count_tokens import compute_stats
+
+
+def concat_datasets(inputs, output, vocab_size=None, clean_inputs=False):
+    """
+    Concatenate indexed datasets (filenames without extension) into one.
+    """
+    # Make sure output folder exists
+    dirname = os.path.dirname(output)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+
+    if len(inputs) == 1:
+        # Simple copy
+        input = inputs[0]
+        for ext in [".idx", ".bin", ".json"]:
+            if os.path.exists(input + ext):
+                if clean_inputs:
+                    shutil.move(input + ext, output + ext)
+                else:
+                    shutil.copy2(input + ext, output + ext)
+        return output
+
+    output_bin_file = output + ".bin"
+    output_idx_file = output + ".idx"
+
+    try:
+        dtypes = {indexed_dataset.MMapIndexedDataset.Index(input + ".idx").dtype for input in inputs}
+        if dtypes == {indexed_dataset.best_fitting_dtype(vocab_size)}:
+            # Fast path: copy data byte for byte, and rebuild the index with numpy
+            indexed_dataset.concat_indexed_datasets(inputs, output)
+        else:
+            # Convert tokens to the dtype corresponding to the vocabulary size
+            builder = indexed_dataset.make_builder(output_bin_file, impl="mmap", vocab_size=vocab_size)
+            for path in inputs:
+                dataset = indexed_dataset.MMapIndexedDataset(path)
+                for doc in dataset:
+                    builder.add_doc(doc, [len(doc)])
+            builder.finalize(output_idx_file)
+    except (Exception, KeyboardInterrupt) as err:
+        for filename in [output_bin_file, output_idx_file]:
+            if os.path.exists(filename):
+                os.remove(filename)
+        raise err
+
+    # Aggregate statistics in json files
+    if all(os.path.exists(input + ".json") for input in inputs):
+        # Recompute statistics from the output index (cheap, and exact for percentiles)
+        histogram = False
+        for input in inputs:
+            with open(input + ".json") as f:
+                histogram = histogram or ("histogram_tokens" in json.load(f))
+        with open(output + ".json", "w") as f:
+            json.dump(compute_stats(output, histogram=histogram), f, indent=2)
+
+    if clean_inputs:
+        for input in inputs:
+            for ext in [".idx", ".json", ".bin"]:
+                if os.path.exists(input + ext):
+                    os.remove(input + ext)
+
+    return output
 
-rootdir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-megatron_deepspeed_folder = os.path.join(rootdir, "Megatron-DeepSpeed")
-sys.path = [megatron_deepspeed_folder] + sys.path  # Better to prepend for "tools" module
 
-from megatron.data import indexed_dataset  # noqa # E402 Module level import not at top of file
+def _concat_datasets(kwargs):
+    return concat_datasets(**kwargs)
+
 
 if __name__ == "__main__":
     import argparse
+    import multiprocessing
 
     parser = argparse.ArgumentParser(
         description="Concatenate MMap Indexed datasets",
@@ -34,6 +96,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--dry-run", "-n", action="store_true", default=False, help="Show what would be done without doing it"
     )
+    parser.add_argument("--workers", type=int, default=1, help="Number of output files processed in parallel")
     args = parser.parse_args()
     vocab_size = args.vocab_size
 
@@ -63,7 +126,8 @@ if __name__ == "__main__":
         inputs_lists = [args.inputs]
         outputs = [args.output]
 
-    for inputs, output in zip(inputs_lists, tqdm.tqdm(outputs)):
+    all_kwargs = []
+    for inputs, output in zip(inputs_lists, outputs):
         assert len(inputs)
         assert output
         assert output not in inputs
@@ -78,64 +142,12 @@ if __name__ == "__main__":
             if args.dry_run:
                 continue
 
-        # Make sure output folder exists
-        dirname = os.path.dirname(output)
-        if dirname and not os.path.exists(dirname):
-            os.makedirs(dirname)
-
-        if len(inputs) == 1:
-            # Simple copy
-            input = inputs[0]
-            for ext in [".idx", ".bin", ".json"]:
-                if os.path.exists(input + ext):
-                    if args.clean_inputs:
-                        shutil.move(input + ext, output + ext)
-                    else:
-                        shutil.copy2(input + ext, output + ext)
-            continue
-
-        output_bin_file = output + ".bin"
-        output_idx_file = output + ".idx"
-
-        # Aggregate data and write output bin
-        builder = indexed_dataset.make_builder(output_bin_file, impl="mmap", vocab_size=vocab_size)
+        all_kwargs.append(dict(inputs=inputs, output=output, vocab_size=vocab_size, clean_inputs=args.clean_inputs))
 
-        try:
-            for path in inputs:
-                dataset = indexed_dataset.MMapIndexedDataset(path)
-                for doc in dataset:
-                    builder.add_doc(doc, [len(doc)])
-        except (Exception, KeyboardInterrupt) as err:
-            if os.path.exists(output_bin_file):
-                os.remove(output_bin_file)
-            raise err
-
-        builder.finalize(output_idx_file)
-
-        # Aggregate statistics in json files
-        if all(os.path.exists(input + ".json") for input in inputs):
-            # Merge json files
-            data = None
-            for input in inputs:
-                with open(input + ".json") as f:
-                    d = json.load(f)
-                if data is None:
-                    data = d
-                else:
-                    for k, v in d.items():
-                        assert k in data
-                        if k.startswith("min"):
-                            data[k] = min(data[k], v)
-                        elif k.startswith("max"):
-                            data[k] = max(data[k], v)
-                        else:
-                            assert k.startswith("total")
-                            data[k] += v
-            with open(output + ".json", "w") as f:
-                json.dump(data, f, indent=2)
-
-        if args.clean_inputs:
-            for input in inputs:
-                for ext in [".idx", ".json", ".bin"]:
-                    if os.path.exists(input + ext):
-                        os.remove(input + ext)
+    if args.workers > 1:
+        with multiprocessing.Pool(args.workers) as pool:
+            for _ in tqdm.tqdm(pool.imap_unordered(_concat_datasets, all_kwargs), total=len(all_kwargs)):
+                pass
+    else:
+        for kwargs in tqdm.tqdm(all_kwargs):
+            concat_datasets(**kwargs)
@@ -1,14 +1,10 @@
 import json
 import os
-import sys
 
+import indexed_dataset
+import numpy as np
 import tqdm
-
-rootdir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-megatron_deepspeed_folder = os.path.join(rootdir, "Megatron-DeepSpeed")
-sys.path = [megatron_deepspeed_folder] + sys.path  # Better to prepend for "tools" module
-from megatron.data import indexed_dataset  # noqa # E402 Module level import not at top of file
-
+from count_tokens import compute_stats
 
 if __name__ == "__main__":
     import argparse
@@ -20,17 +16,28 @@ if __name__ == "__main__":
     parser.add_argument("inputs", type=str, nargs="+", help="Input indexed dataset filenames (without extension)")
     parser.add_argument("output", type=str, help="output folder")
     parser.add_argument(
-        "--vocab_size", type=int, default=65024, help="Vocabulary size (is it larger or not than 65500?)"
+        "--vocab_size",
+        type=int,
+        default=65024,
+        help="Vocabulary size (unused: tokens are copied with the dtype of the input datasets)",
     )
     parser.add_argument(
-        "--tokens_split", type=int, default=4096, help="Token size threshold (to decide if a document is short or long)"
+        "--tokens_split",
+        type=int,
+        nargs="+",
+        default=[4096],
+        help="Token size threshold(s) (to decide if a document is short or long)."
+        " With several thresholds (ex: 2048 4096 8192), documents are split into length buckets in one pass",
     )
     parser.add_argument(
         "--collect-stats", "-n", action="store_true", default=False, help="Only collect stats about document lengths"
     )
     args = parser.parse_args()
 
-    vocab_size = args.vocab_size
+    thresholds = sorted(set(args.tokens_split))
+    # A document of N tokens goes to bucket i such that bounds[i] < N <= bounds[i+1]
+    bounds = [0, *thresholds, "inf"]
+    bucket_folders = [f"length-{a}-{b}" for a, b in zip(bounds[:-1], bounds[1:])]
 
     def get_filenames():
         for f in args.inputs:
@@ -61,18 +68,13 @@ if __name__ == "__main__":
 
     all_paths = [path for path in all_paths if select_file(path)]
 
-    all_paths = [
-        path
-        for path in all_paths
-        if (
-            not os.path.exists(
-                os.path.join(args.output, f"length-0-{args.tokens_split}", os.path.basename(path) + ".bin")
-            )
-            and not os.path.exists(
-                os.path.join(args.output, f"length-{args.tokens_split}-inf", os.path.basename(path) + ".bin")
-            )
-        )
-    ]
+    def get_outputs(path):
+        return [os.path.join(args.output, folder, os.path.basename(path)) for folder in bucket_folders]
+
+    if not args.collect_stats:
+        all_paths = [
+            path for path in all_paths if not any(os.path.exists(output + ".bin") for output in get_outputs(path))
+        ]
 
     assert len(all_paths) > 0, "No files to process"
 
@@ -80,86 +82,42 @@ if __name__ == "__main__":
     for path in progress_bar:
         progress_bar.set_description(f"Processing {os.path.basename(path)}")
 
-        _lengths = []
-        stats_small = {"total_tokens": 0, "total_sequences": 0, "min_tokens": 1e10, "max_tokens": 0}
-        stats_large = stats_small.copy()
-
-        # Aggregate data and write output bin
+        # Document lengths are read from the index only
+        index = indexed_dataset.MMapIndexedDataset.Index(indexed_dataset.index_file_path(path))
+        doc_sizes, _ = indexed_dataset.document_sizes(index)
 
         if args.collect_stats:
             output_length_stats = os.path.join("length_stats", os.path.basename(path) + ".json")
             if os.path.exists(output_length_stats):
                 continue
-
-        else:
-            output_tokens_small = os.path.join(args.output, f"length-0-{args.tokens_split}", os.path.basename(path))
-            output_tokens_large = os.path.join(args.output, f"length-{args.tokens_split}-inf", os.path.basename(path))
-            os.makedirs(os.path.dirname(output_tokens_small), exist_ok=True)
-            os.makedirs(os.path.dirname(output_tokens_large), exist_ok=True)
-
-            if os.path.exists(output_tokens_small + ".bin") or os.path.exists(output_tokens_large + ".bin"):
-                continue
-
-            builder_small = indexed_dataset.make_builder(
-                output_tokens_small + ".bin", impl="mmap", vocab_size=vocab_size
-            )
-            builder_large = indexed_dataset.make_builder(
-                output_tokens_large + ".bin", impl="mmap", vocab_size=vocab_size
-            )
+            os.makedirs(os.path.dirname(output_length_stats), exist_ok=True)
+            with open(output_length_stats, "w") as f:
+                json.dump(doc_sizes[: max_len_for_stats + 1].tolist(), f, indent=2)
+            continue
+
+        outputs = get_outputs(path)
+        buckets = np.searchsorted(thresholds, doc_sizes, side="left")
+        counts = np.bincount(buckets, minlength=len(outputs))
+        for i, output in enumerate(outputs):
+            if counts[i]:
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+            else:
+                print(f"Warning: {output} is empty")
+                outputs[i] = None
 
         try:
-            dataset = indexed_dataset.MMapIndexedDataset(path)
-            for i, doc in enumerate(dataset):
-                if args.collect_stats:
-                    _lengths.append(len(doc))
-                    if max_len_for_stats and i >= max_len_for_stats:
-                        break
-                else:
-                    if len(doc) <= args.tokens_split:
-                        builder_small.add_doc(doc, [len(doc)])
-                        stats = stats_small
-                    else:
-                        builder_large.add_doc(doc, [len(doc)])
-                        stats = stats_large
-                    ntokens = len(doc)
-                    stats["total_tokens"] += ntokens
-                    stats["total_sequences"] += 1
-                    stats["min_tokens"] = min(stats["min_tokens"], ntokens)
-                    stats["max_tokens"] = max(stats["max_tokens"], ntokens)
-
-            # Finalize
-            print()
-            if not args.collect_stats:
-                if stats_small["total_sequences"]:
-                    builder_small.finalize(output_tokens_small + ".idx")
-                    with open(output_tokens_small + ".json", "w") as f:
-                        json.dump(stats_small, f, indent=2)
-                else:
-                    print(f"Warning: {output_tokens_small} is empty")
-                    del builder_small
-                    for ext in [".bin", ".idx"]:
-                        if os.path.exists(output_tokens_small + ext):
-                            os.remove(output_tokens_small + ext)
-
-                if stats_large["total_sequences"]:
-                    builder_large.finalize(output_tokens_large + ".idx")
-                    with open(output_tokens_large + ".json", "w") as f:
-                        json.dump(stats_large, f, indent=2)
-                else:
-                    print(f"Warning: {output_tokens_large} is empty")
-                    del builder_large
-                    for ext in [".bin", ".idx"]:
-                        if os.path.exists(output_tokens_large + ext):
-                            os.remove(output_tokens_large + ext)
+            indexed_dataset.split_indexed_dataset(path, outputs, buckets)
+
+            for output in outputs:
+                if output is not None:
+                    with open(output + ".json", "w") as f:
+                        json.dump(compute_stats(output), f, indent=2)
 
         except (Exception, KeyboardInterrupt) as err:
-            for f in [output_tokens_small, output_tokens_large]:
-                for ext in [".bin", ".idx"]:
+            for f in outputs:
+                if f is None:
+                    continue
+                for ext in [".bin", ".idx", ".json"]:
                     if os.path.exists(f + ext):
                         os.remove(f + ext)
             raise err
-
-        if args.collect_stats:
-            os.makedirs(os.path.dirname(output_length_stats), exist_ok=True)
-            with open(output_length_stats, "w") as f:
-                json.dump(_lengths, f, indent=2)
@@ -0,0 +1,344 @@
+"""
+Reader and writer for Megatron "mmap" indexed datasets (*.bin / *.idx files),
+that do not depend on Megatron-DeepSpeed (only numpy).
+
+Files are byte-compatible with megatron.data.indexed_dataset:
+- the *.bin file contains all the tokens (concatenated), with a dtype depending on the vocabulary size,
+- the *.idx file contains a header, followed by the sizes (int32) and pointers (int64, in bytes) of all the sequences,
+  and the document indices (int64, index of the first sequence of each document, plus the total number of sequences).
+"""
+
+import array
+import os
+import struct
+
+import numpy as np
+
+_HDR_MAGIC = b"MMIDIDX\x00\x00"
+_VERSION = 1
+
+dtypes = {
+    1: np.uint8,
+    2: np.int8,
+    3: np.int16,
+    4: np.int32,
+    5: np.int64,
+    6: np.float64,
+    7: np.double,
+    8: np.uint16,
+}
+
+
+def code(dtype):
+    for k, v in dtypes.items():
+        if v == dtype:
+            return k
+    raise ValueError(f"Unsupported dtype {dtype}")
+
+
+def best_fitting_dtype(vocab_size=None):
+    if vocab_size is not None and vocab_size < 65500:
+        return np.uint16
+    else:
+        return np.int32
+
+
+def index_file_path(prefix_path):
+    return prefix_path + ".idx"
+
+
+def data_file_path(prefix_path):
+    return prefix_path + ".bin"
+
+
+def make_builder(out_file, impl="mmap", vocab_size=None):
+    if impl != "mmap":
+        raise NotImplementedError(f"Only 'mmap' indexed datasets are supported (not '{impl}')")
+    return MMapIndexedDatasetBuilder(out_file, dtype=best_fitting_dtype(vocab_size))
+
+
+def _memmap(path, dtype=np.uint8):
+    if os.path.getsize(path) == 0:
+        # Cannot mmap an empty file
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", order="C")
+
+
+class MMapIndexedDataset:
+    class Index:
+        def __init__(self, path):
+            with open(path, "rb") as stream:
+                magic_test = stream.read(9)
+                assert magic_test == _HDR_MAGIC, f"{path} is not a MMap indexed dataset index (wrong header)"
+                (version,) = struct.unpack("<Q", stream.read(8))
+                assert version == _VERSION, f"Unsupported version {version} in {path}"
+                (dtype_code,) = struct.unpack("<B", stream.read(1))
+                self._dtype = dtypes[dtype_code]
+                self._dtype_size = np.dtype(self._dtype).itemsize
+                (self._len,) = struct.unpack("<Q", stream.read(8))
+                (self._doc_count,) = struct.unpack("<Q", stream.read(8))
+                offset = stream.tell()
+
+            self._bin_buffer = _memmap(path)
+            self._sizes = np.frombuffer(self._bin_buffer, dtype=np.int32, count=self._len, offset=offset)
+            offset += self._sizes.nbytes
+            self._pointers = np.frombuffer(self._bin_buffer, dtype=np.int64, count=self._len, offset=offset)
+            offset += self._pointers.nbytes
+            self._doc_idx = np.frombuffer(self._bin_buffer, dtype=np.int64, count=self._doc_count, offset=offset)
+
+        @staticmethod
+        def write(path, dtype, sizes, doc_idx):
+            sizes = np.asarray(sizes, dtype=np.int32)
+            doc_idx = np.asarray(doc_idx, dtype=np.int64)
+            pointers = np.zeros(len(sizes), dtype=np.int64)
+            np.cumsum(sizes[:-1], dtype=np.int64, out=pointers[1:])
+            pointers *= np.dtype(dtype).itemsize
+            with open(path, "wb") as f:
+                f.write(_HDR_MAGIC)
+                f.write(struct.pack("<Q", _VERSION))
+                f.write(struct.pack("<B", code(dtype)))
+                f.write(struct.pack("<Q", len(sizes)))
+                f.write(struct.pack("<Q", len(doc_idx)))
+                f.write(sizes.tobytes(order="C"))
+                f.write(pointers.tobytes(order="C"))
+                f.write(doc_idx.tobytes(order="C"))
+
+        @property
+        def dtype(self):
+            return self._dtype
+
+        @property
+        def sizes(self):
+            return self._sizes
+
+        @property
+        def pointers(self):
+            return self._pointers
+
+        @property
+        def doc_idx(self):
+            return self._doc_idx
+
+        def __getitem__(self, i):
+            return self._pointers[i], self._sizes[i]
+
+        def __len__(self):
+            return self._len
+
+    def __init__(self, path):
+        self._path = path
+        self._index = self.Index(index_file_path(path))
+        self._bin_buffer = _memmap(data_file_path(path))
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def dtype(self):
+        return self._index.dtype
+
+    @property
+    def sizes(self):
+        """Number of tokens of each sequence (numpy array, read from the index only)"""
+        return self._index.sizes
+
+    @property
+    def doc_idx(self):
+        return self._index.doc_idx
+
+    @property
+    def num_tokens(self):
+        return int(self._index.sizes.sum(dtype=np.int64))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            ptr, size = self._index[idx]
+            return np.frombuffer(self._bin_buffer, dtype=self.dtype, count=size, offset=ptr)
+        elif isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                raise ValueError("Slices into indexed datasets must be contiguous")
+            ptr = self._index.pointers[start]
+            sizes = self._index.sizes[idx]
+            offsets = np.cumsum(sizes)[:-1]
+            np_array = np.frombuffer(self._bin_buffer, dtype=self.dtype, count=int(sizes.sum()), offset=ptr)
+            return np.split(np_array, offsets)
+        raise TypeError(f"Invalid index type {type(idx)}")
+
+    def get(self, idx, offset=0, length=None):
+        """
+        Retrieve a single item from the dataset with the option to only return a portion of the item.
+        """
+        ptr, size = self._index[idx]
+        if length is None:
+            length = size - offset
+        ptr += offset * np.dtype(self.dtype).itemsize
+        return np.frombuffer(self._bin_buffer, dtype=self.dtype, count=length, offset=ptr)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(index_file_path(path)) and os.path.exists(data_file_path(path))
+
+
+class MMapIndexedDatasetBuilder:
+    def __init__(self, out_file, dtype=np.int64):
+        self._data_file = open(out_file, "wb")
+        self._dtype = dtype
+        # Compact arrays (rather than lists of python integers)
+        self._sizes = array.array("i")
+        self._doc_idx = array.array("q", [0])
+
+    def add_item(self, tensor):
+        np_array = np.asarray(tensor, dtype=self._dtype)
+        self._data_file.write(np_array.tobytes(order="C"))
+        self._sizes.append(np_array.size)
+
+    def add_doc(self, tensor, sizes):
+        np_array = np.asarray(tensor, dtype=self._dtype)
+        self._data_file.write(np_array.tobytes(order="C"))
+        self._sizes.extend(sizes)
+        self._doc_idx.append(len(self._sizes))
+
+    def end_document(self):
+        self._doc_idx.append(len(self._sizes))
+
+    def merge_file_(self, another_file):
+        # Concatenate index
+        index = MMapIndexedDataset.Index(index_file_path(another_file))
+        assert index.dtype == self._dtype, f"dtype mismatch: {index.dtype} != {self._dtype}"
+
+        offset = len(self._sizes)
+        self._sizes.frombytes(index.sizes.tobytes())
+        self._doc_idx.frombytes((offset + index.doc_idx[1:]).tobytes())
+
+        # Concatenate data
+        append_file(data_file_path(another_file), self._data_file)
+
+    def finalize(self, index_file):
+        self._data_file.close()
+        MMapIndexedDataset.Index.write(index_file, self._dtype, self._sizes, self._doc_idx)
+
+
+def copy_file_range(fin, fout, offset, count, buffer_size=16 * 1024 * 1024):
+    """
+    Append count bytes of a file opened in binary read mode (starting at offset) to a file opened in binary write mode.
+    When possible, data is copied by the kernel (copy_file_range), without going through python buffers.
+    """
+    fout.flush()
+    remaining = count
+    try:
+        while remaining > 0:
+            n = os.copy_file_range(fin.fileno(), fout.fileno(), remaining, offset + count - remaining)
+            if n == 0:
+                break
+            remaining -= n
+    except (AttributeError, OSError):
+        # copy_file_range is not available (or not supported between these file systems)
+        pass
+    if remaining > 0:
+        fin.seek(offset + count - remaining)
+        while remaining > 0:
+            buffer = fin.read(min(buffer_size, remaining))
+            if not buffer:
+                raise EOFError(f"Unexpected end of file in {fin.name}")
+            fout.write(buffer)
+            remaining -= len(buffer)
+        fout.flush()
+    # Make sure the python file object is positioned at the end of the file
+    fout.seek(0, os.SEEK_END)
+
+
+def append_file(src_path, fout, buffer_size=16 * 1024 * 1024):
+    """
+    Append the content of a file to a file opened in binary write mode.
+    """
+    with open(src_path, "rb") as fin:
+        copy_file_range(fin, fout, 0, os.fstat(fin.fileno()).st_size, buffer_size=buffer_size)
+
+
+def concat_indexed_datasets(inputs, output):
+    """
+    Concatenate indexed datasets, without decoding tokens:
+    the *.bin files are appended byte for byte, and the index is rebuilt with numpy.
+
+    :param inputs: list of indexed datasets (filenames without extension)
+    :param output: output indexed dataset (filename without extension)
+    """
+    indices = [MMapIndexedDataset.Index(index_file_path(input)) for input in inputs]
+    dtype = indices[0].dtype
+    for input, index in zip(inputs, indices):
+        assert index.dtype == dtype, f"dtype mismatch: {index.dtype} ({input}) != {dtype} ({inputs[0]})"
+
+    sizes = np.concatenate([index.sizes for index in indices])
+    doc_idx = [np.zeros(1, dtype=np.int64)]
+    offset = 0
+    for index in indices:
+        doc_idx.append(offset + index.doc_idx[1:])
+        offset += len(index)
+    doc_idx = np.concatenate(doc_idx)
+
+    with open(data_file_path(output), "wb") as fout:
+        for input in inputs:
+            append_file(data_file_path(input), fout)
+
+    MMapIndexedDataset.Index.write(index_file_path(output), dtype, sizes, doc_idx)
+
+
+def _token_offsets(index):
+    # Offset (in tokens) of the beginning of each document, and of the end of the data
+    cumsizes = np.zeros(len(index) + 1, dtype=np.int64)
+    np.cumsum(index.sizes, dtype=np.int64, out=cumsizes[1:])
+    return cumsizes[index.doc_idx]
+
+
+def document_sizes(index):
+    """
+    Number of tokens (and number of sequences) of each document of an indexed dataset, computed from its index only.
+    """
+    return np.diff(_token_offsets(index)), np.diff(index.doc_idx)
+
+
+def split_indexed_dataset(path, outputs, buckets):
+    """
+    Split an indexed dataset into several ones, without decoding tokens:
+    contiguous runs of documents of the same output are copied byte for byte, and each index is built once with numpy.
+
+    :param path: input indexed dataset (filename without extension)
+    :param outputs: output indexed datasets (filenames without extension), or None for outputs to skip
+    :param buckets: numpy array with the index (in outputs) of the output of each document
+    """
+    index = MMapIndexedDataset.Index(index_file_path(path))
+    num_docs = len(index.doc_idx) - 1
+    assert len(buckets) == num_docs, f"Got {len(buckets)} buckets for {num_docs} documents"
+    itemsize = np.dtype(index.dtype).itemsize
+
+    num_sequences = np.diff(index.doc_idx)
+    doc_offsets = _token_offsets(index) * itemsize
+
+    with open(data_file_path(path), "rb") as fin:
+        for i, output in enumerate(outputs):
+            if output is None:
+                continue
+            selected = buckets == i
+
+            # Runs of consecutive selected documents: [start, end[
+            transitions = np.diff(np.concatenate([[0], selected.astype(np.int8), [0]]))
+            starts = np.flatnonzero(transitions == 1)
+            ends = np.flatnonzero(transitions == -1)
+
+            with open(data_file_path(output), "wb") as fout:
+                for start, end in zip(doc_offsets[starts], doc_offsets[ends]):
+                    copy_file_range(fin, fout, int(start), int(end - start))
+
+            sizes = index.sizes[np.repeat(selected, num_sequences)]
+            out_doc_idx = np.zeros(selected.sum() + 1, dtype=np.int64)
+            np.cumsum(num_sequences[selected], out=out_doc_idx[1:])
+            MMapIndexedDataset.Index.write(index_file_path(output), index.dtype, sizes, out_doc_idx)
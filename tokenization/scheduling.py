@@ -0,0 +1,143 @@
+"""
+Scheduling of work items on a pool of workers, based on estimates of the size of datasets.
+
+Work items are dispatched one at a time, largest first (LPT: Longest Processing Time first),
+so that the largest datasets do not end up being processed alone at the end of a run.
+Sizes (number of characters) are estimated from the statistics in assets/stats_raw,
+and from the size of local files for datasets without statistics.
+"""
+
+import glob
+import heapq
+import json
+import os
+from collections import Counter
+
+_folder = os.path.dirname(os.path.realpath(__file__))
+_asset_folder = os.path.join(os.path.dirname(_folder), "assets")
+
+DEFAULT_STATS_FOLDER = os.path.join(_asset_folder, "stats_raw")
+
+
+def load_raw_stats(folder=DEFAULT_STATS_FOLDER):
+    """
+    Return a dictionary {name: number of characters} from the files stats_{name}.json of a folder.
+    """
+    stats = {}
+    for filename in glob.glob(os.path.join(folder, "stats_*.json")):
+        name = os.path.splitext(os.path.basename(filename))[0][len("stats_") :]
+        try:
+            with open(filename, encoding="utf8") as f:
+                num_chars = json.load(f).get("num chars")
+        except (OSError, json.JSONDecodeError):
+            continue
+        if num_chars:
+            stats[name] = num_chars
+    return stats
+
+
+def match_stats(name, stats):
+    """
+    Return the longest name in stats whose fields (separated by "--") appear consecutively in the given name,
+    or None.
+    """
+    fields = name.replace(":", "--").split("--")
+    best = None
+    for key in stats:
+        key_fields = key.split("--")
+        n = len(key_fields)
+        if any(fields[i : i + n] == key_fields for i in range(len(fields) - n + 1)):
+            if best is None or n > len(best.split("--")):
+                best = key
+    return best
+
+
+def local_file_size(dataset):
+    if isinstance(dataset, str):
+        files = [dataset]
+    else:
+        files = getattr(dataset, "parquet_files", None) or []
+    files = [f for f in files if os.path.isfile(f)]
+    return sum(os.path.getsize(f) for f in files) if files else None
+
+
+def estimate_sizes(datasets, stats_folder=DEFAULT_STATS_FOLDER):
+    """
+    Estimate the number of characters of datasets.
+
+    :param datasets: dictionary {name: dataset}
+    :param stats_folder: folder with statistics (see data.py)
+    :return: dictionary {name: estimated size}
+    """
+    stats = load_raw_stats(stats_folder) if stats_folder else {}
+    matches = {name: match_stats(name, stats) for name in datasets}
+    # Statistics of a config are shared by all its subsets (ex: all the parquet files of a config)
+    num_matches = Counter(matches.values())
+    sizes = {}
+    for name, dataset in datasets.items():
+        key = matches[name]
+        if key is not None:
+            sizes[name] = stats[key] / num_matches[key]
+        else:
+            sizes[name] = local_file_size(dataset)
+    known = sorted(size for size in sizes.values() if size)
+    default_size = known[len(known) // 2] if known else 1
+    return {name: size if size else default_size for name, size in sizes.items()}
+
+
+def lpt_makespan(sizes, num_workers):
+    """
+    Total size processed by the most loaded worker, when work items of given sizes are dispatched largest first
+    to the first available worker (assuming all workers have the same speed).
+    """
+    loads = [0] * max(1, num_workers)
+    for size in sorted(sizes, reverse=True):
+        heapq.heapreplace(loads, loads[0] + size)
+    return max(loads)
+
+
+class CompletionTimePredictor:
+    """
+    Predict the duration of a run from the sizes of completed work items, and the time elapsed.
+
+    Items that were skipped (already done, ex: when resuming a run) are left out of the observed throughput
+    and of the remaining work.
+    """
+
+    def __init__(self, sizes, num_workers, start_time, fraction_for_prediction=0.1):
+        self.num_workers = max(1, num_workers)
+        self.sizes = Counter(sizes)
+        self.total_size = sum(sizes)
+        self.makespan = lpt_makespan(sizes, num_workers)
+        self.start_time = start_time
+        self.done_size = 0
+        self.skipped_size = 0
+        self.fraction_for_prediction = fraction_for_prediction
+        # Prediction made when a given fraction of the data was processed, to compare with the actual duration
+        self.first_prediction = None
+        self._makespan_is_outdated = False
+
+    def update(self, size, current_time, skipped=False):
+        """
+        Register a completed (or skipped) work item, and return the predicted total duration (in seconds, or None).
+        """
+        if skipped:
+            self.skipped_size += size
+            self.total_size -= size
+            self.sizes[size] -= 1
+            self._makespan_is_outdated = True
+        else:
+            self.done_size += size
+        # Time spent on skipped items is negligible: the time elapsed is the one of processed items
+        elapsed = current_time - self.start_time
+        if not self.done_size or elapsed <= 0:
+            return None
+        if self._makespan_is_outdated:
+            self.makespan = lpt_makespan(list(self.sizes.elements()), self.num_workers)
+            self._makespan_is_outdated = False
+        # Speed of one worker (assuming all workers were busy)
+        speed = self.done_size / elapsed / self.num_workers
+        prediction = self.makespan / speed
+        if self.first_prediction is None and self.done_size >= self.fraction_for_prediction * self.total_size:
+            self.first_prediction = prediction
+        return prediction
@@ -3,22 +3,26 @@
 # Inspired from Megatron-DeepSpeed/tools/preprocess_data.py
 
 import argparse
+import bisect
+import hashlib
+import itertools
 import json
 import multiprocessing
 import os
-import random
+import resource
 import sys
 import time
 
 import regex as re
 
+import indexed_dataset
 from data import decompose_datasets, get_datasets
+from scheduling import DEFAULT_STATS_FOLDER, CompletionTimePredictor, estimate_sizes
 
 rootdir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 megatron_deepspeed_folder = os.path.join(rootdir, "Megatron-DeepSpeed")
 sys.path = [megatron_deepspeed_folder] + sys.path  # Better to prepend for "tools" module
 
-from megatron.data import indexed_dataset  # noqa # E402 Module level import not at top of file
 from megatron.tokenizer import build_tokenizer  # noqa # E402 Module level import not at top of file
 
 
@@ -26,9 +30,18 @@ class Encoder:
     def __init__(self, args):
         self.args = args
 
-    def initializer(self):
+    def initializer(self, tokenizer=None):
+        # Number of threads used by the Rust backend of fast tokenizers when encoding batches.
+        # Must be set before the first call to the batch API (the thread pool is created lazily).
+        os.environ["RAYON_NUM_THREADS"] = str(max(1, self.args.threads_tokenization))
+        os.environ["TOKENIZERS_PARALLELISM"] = "true" if self.args.threads_tokenization > 1 else "false"
         # Use Encoder class as a container for global data
-        Encoder.tokenizer = build_tokenizer(self.args)
+        # (the tokenizer can be given, or already loaded in this process, to avoid loading it again)
+        if tokenizer is None:
+            tokenizer = getattr(Encoder, "tokenizer", None)
+        if tokenizer is None:
+            tokenizer = build_tokenizer(self.args)
+        Encoder.tokenizer = tokenizer
 
     def normalizer(self, text):
         tokenizer = Encoder.tokenizer.tokenizer.backend_tokenizer
@@ -38,80 +51,150 @@ class Encoder:
         pad_to = self.args.pad_to
         if key is None:
             key = self.args.json_keys[0]
+        if max_len_at_once is None:
+            max_len_at_once = self.args.max_len_at_once
         if isinstance(text, list):
             sentences = text
         else:
             sentences = [text]
-        doc_ids = []
-        sentence_lens = []
+        all_sentence_ids = []
         for sentence in sentences:
             # JL: remove trailing whitespaces and line breaks
             sentence = sentence.rstrip()
-            # TODO: use 50000 for default max_len_at_once
             if max_len_at_once and len(sentence) > max_len_at_once:
-                # JL: Split around digits (assuming the tokenizer will split around them)
-                #     Note: this is an ugly workaround, specific to the tokenizer used (Lucie2.9)
-                sentence_ids = []
-                eos = None
-                num_splits = 0
-                must_delete_first_space = False
-                # _space_token = Encoder.tokenizer.tokenizer.encode("1")[1]
-                while len(sentence):
-                    pos = max(1, max_len_at_once // 2)
-                    next_digit = re.search(r"\d", sentence, pos=pos)
-                    while next_digit is None and pos > 100:
-                        pos = pos // 2
-                        next_digit = re.search(r"\d", sentence, pos=pos)
-                    if next_digit:
-                        next_digit = next_digit.start()
-                    else:
-                        next_digit = len(sentence)
-                    assert next_digit > 0  # Avoid infinite loop
-                    part_of_sentence = sentence[:next_digit]
-                    sentence = sentence[next_digit:]
-                    part_of_sentence_ids = Encoder.tokenizer.tokenize(part_of_sentence)
-                    if len(sentence_ids):
-                        # Remove BOS
-                        part_of_sentence_ids = part_of_sentence_ids[1:]
-                        if must_delete_first_space:
-                            # assert part_of_sentence_ids[0] == _space_token, \
-                            #    f"Space token mismatch: {part_of_sentence_ids[0]} != {space_token}"
-                            part_of_sentence_ids = part_of_sentence_ids[1:]
-
-                    # Remove EOS
-                    if eos is None:
-                        eos = part_of_sentence_ids[-1]
-                    else:
-                        assert eos == part_of_sentence_ids[-1], f"EOS mismatch: {eos} != {part_of_sentence_ids[-1]}"
-                    if len(sentence):
-                        part_of_sentence_ids = part_of_sentence_ids[:-1]
-                    # Accumulate result
-                    if pad_to:
-                        raise NotImplementedError("pad_to not implemented with max_len_at_once")
-                    sentence_ids.extend(part_of_sentence_ids)
-                    num_splits += 1
-                    # TODO: the following might fail
-                    last_char = self.normalizer(part_of_sentence[-100:])[-1]
-                    must_delete_first_space = last_char not in "\n\t(['’\"«“‘‚‹—–―"
-                assert num_splits >= 1
-                # if num_splits > 1:
-                #     print(f"Splitted {len_sentence} characters into {num_splits} parts")
-            else:
-                sentence_ids = Encoder.tokenizer.tokenize(sentence)
                 if pad_to:
-                    if len(sentence_ids) > pad_to:
-                        print(f"WARNING: Sentence too long: {len(sentence_ids)} > {pad_to} => clipping")
-                        sentence_ids = sentence_ids[:pad_to]
-                    elif len(sentence_ids) < pad_to:
-                        pad_token = Encoder.tokenizer.eod if use_eod_for_padding else Encoder.tokenizer.pad
-                        sentence_ids.extend([pad_token] * (pad_to - len(sentence_ids)))
-                    assert len(sentence_ids) == pad_to
+                    raise NotImplementedError("pad_to not implemented with max_len_at_once")
+                sentence_ids = self.encode_long(sentence, max_len_at_once)
+            else:
+                sentence_ids = self.pad(Encoder.tokenizer.tokenize(sentence), use_eod_for_padding)
+            all_sentence_ids.append(sentence_ids)
+        return self.make_doc(all_sentence_ids, key, len(text))
+
+    def split_offsets(self, text, max_len_at_once):
+        """
+        Offsets of the chunks of a long text, that are split before digits (assuming the tokenizer splits around them).
+
+        Each chunk ends before the first digit found after max_len_at_once/2 characters
+        (or max_len_at_once/4, ... if there is no such digit, down to ~100 characters).
+        Digits are found in one scan of the text.
+        """
+        digits = [m.start() for m in re.finditer(r"\d", text)]
+        steps = [max(1, max_len_at_once // 2)]
+        while steps[-1] > 100:
+            steps.append(steps[-1] // 2)
+        offsets = [0]
+        while offsets[-1] < len(text):
+            start = offsets[-1]
+            end = len(text)
+            for step in steps:
+                i = bisect.bisect_left(digits, start + step)
+                if i < len(digits):
+                    end = digits[i]
+                    break
+            offsets.append(end)
+        return offsets
+
+    def encode_long(self, text, max_len_at_once):
+        """
+        Tokenize a long text by chunks (tokenized in one batch), and stitch the token ids.
+        """
+        # JL: Split around digits (assuming the tokenizer will split around them)
+        #     Note: this is an ugly workaround, specific to the tokenizer used (Lucie2.9)
+        offsets = self.split_offsets(text, max_len_at_once)
+        chunks = [text[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        ids = []
+        eos = None
+        must_delete_first_space = False
+        for i, (chunk, chunk_ids) in enumerate(zip(chunks, self.tokenize_batch(chunks))):
+            is_last = i == len(chunks) - 1
+            if len(ids):
+                # Remove BOS
+                chunk_ids = chunk_ids[1:]
+                if must_delete_first_space:
+                    chunk_ids = chunk_ids[1:]
+            # Remove EOS
+            if eos is None:
+                eos = chunk_ids[-1]
+            else:
+                assert eos == chunk_ids[-1], f"EOS mismatch: {eos} != {chunk_ids[-1]}"
+            if not is_last:
+                chunk_ids = chunk_ids[:-1]
+                # TODO: the following might fail
+                last_char = self.normalizer(chunk[-100:])[-1]
+                must_delete_first_space = last_char not in "\n\t(['’\"«“‘‚‹—–―"
+            ids.extend(chunk_ids)
+
+        if self.args.check_long_documents and len(chunks) > 1:
+            reference_ids = Encoder.tokenizer.tokenize(text)
+            if list(reference_ids) != ids:
+                num_diffs = sum(a != b for a, b in zip(reference_ids, ids)) + abs(len(reference_ids) - len(ids))
+                print(
+                    f"WARNING: Tokenization by chunks differs from tokenization at once ({num_diffs} different ids,"
+                    f" {len(chunks)} chunks) for text starting with {text[:50]!r}"
+                )
+        return ids
+
+    def pad(self, sentence_ids, use_eod_for_padding=True):
+        pad_to = self.args.pad_to
+        if pad_to:
+            if len(sentence_ids) > pad_to:
+                print(f"WARNING: Sentence too long: {len(sentence_ids)} > {pad_to} => clipping")
+                sentence_ids = sentence_ids[:pad_to]
+            elif len(sentence_ids) < pad_to:
+                pad_token = Encoder.tokenizer.eod if use_eod_for_padding else Encoder.tokenizer.pad
+                sentence_ids.extend([pad_token] * (pad_to - len(sentence_ids)))
+            assert len(sentence_ids) == pad_to
+        return sentence_ids
+
+    def make_doc(self, all_sentence_ids, key, num_chars):
+        doc_ids = []
+        sentence_lens = []
+        for sentence_ids in all_sentence_ids:
             if len(sentence_ids) > 0:
                 doc_ids.extend(sentence_ids)
                 sentence_lens.append(len(sentence_ids))
         if len(doc_ids) > 0 and self.args.append_eod:
             doc_ids.append(Encoder.tokenizer.eod)
-        return {key: doc_ids}, {key: sentence_lens}, len(text)
+        return {key: doc_ids}, {key: sentence_lens}, num_chars
+
+    def tokenize_batch(self, sentences):
+        """
+        Tokenize a list of strings at once.
+        With a fast tokenizer from HuggingFace, this relies on the batch API of the Rust backend,
+        which is multi-threaded (see --threads_tokenization).
+        """
+        hf_tokenizer = getattr(Encoder.tokenizer, "tokenizer", None)
+        if hasattr(hf_tokenizer, "backend_tokenizer"):
+            # Same as hf_tokenizer.encode(sentence) for each sentence
+            return hf_tokenizer(sentences, add_special_tokens=True, verbose=False)["input_ids"]
+        return [Encoder.tokenizer.tokenize(sentence) for sentence in sentences]
+
+    def encode_batch(self, texts, key=None, max_len_at_once=None, use_eod_for_padding=True):
+        """
+        Same as encode(), but on a list of documents, and returns a list of results (in the same order).
+        """
+        if key is None:
+            key = self.args.json_keys[0]
+        if max_len_at_once is None:
+            max_len_at_once = self.args.max_len_at_once
+        results = [None] * len(texts)
+        batch_indices = []
+        batch_sentences = []
+        for i, text in enumerate(texts):
+            if isinstance(text, list) or (max_len_at_once and len(text.rstrip()) > max_len_at_once):
+                # Lists of sentences and long documents are processed one by one
+                results[i] = self.encode(
+                    text, key=key, max_len_at_once=max_len_at_once, use_eod_for_padding=use_eod_for_padding
+                )
+            else:
+                batch_indices.append(i)
+                # JL: remove trailing whitespaces and line breaks
+                batch_sentences.append(text.rstrip())
+        if len(batch_sentences):
+            for i, sentence_ids in zip(batch_indices, self.tokenize_batch(batch_sentences)):
+                sentence_ids = self.pad(sentence_ids, use_eod_for_padding)
+                results[i] = self.make_doc([sentence_ids], key, len(texts[i]))
+        return results
 
     def encode_json(self, json_line):
         data = json.loads(json_line)
@@ -124,21 +207,270 @@ class Encoder:
             lens.update(_len)
         return ids, lens, len(json_line)
 
+    def encode_json_batch(self, json_lines):
+        datas = [json.loads(json_line) for json_line in json_lines]
+        ids = [{} for _ in datas]
+        lens = [{} for _ in datas]
+        for key in self.args.json_keys:
+            for i, (_id, _len, _) in enumerate(self.encode_batch([data[key] for data in datas], key=key)):
+                ids[i].update(_id)
+                lens[i].update(_len)
+        return [(_id, _len, len(json_line)) for _id, _len, json_line in zip(ids, lens, json_lines)]
+
+
+def batched_map(func, iterable, batch_size):
+    """
+    Like map(), but calling func on lists of (at most) batch_size elements,
+    func being expected to return a list of results of the same length.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield from func(batch)
+
+
+class JsonlShard:
+    """
+    Lines of a jsonl file that start in a contiguous range of bytes (the part number shard_index among num_shards).
+    Iterating on all the shards in order gives all the lines of the file.
+    """
+
+    def __init__(self, filename, num_shards=1, shard_index=0):
+        assert 0 <= shard_index < num_shards
+        self.filename = filename
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+
+    def __str__(self):
+        if self.num_shards == 1:
+            return self.filename
+        return f"{self.filename} (part {self.shard_index+1}/{self.num_shards})"
+
+    def __iter__(self):
+        size = os.path.getsize(self.filename)
+        start = self.shard_index * size // self.num_shards
+        end = (self.shard_index + 1) * size // self.num_shards
+        with open(self.filename, "rb") as f:
+            if start > 0:
+                # Skip the line that started in the previous part
+                f.seek(start - 1)
+                f.readline()
+            while f.tell() < end:
+                line = f.readline()
+                if not line:
+                    break
+                yield line.decode("utf-8")
+
+    def fingerprint(self):
+        stat = os.stat(self.filename)
+        return {
+            "path": os.path.abspath(self.filename),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "shard": [self.shard_index, self.num_shards],
+        }
+
 
 def current_date():
     return time.strftime("%Y-%m-%d %H:%M:%S")
 
 
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+class ProcessingMetrics:
+    """
+    Counters and timings of the processing of one input, to know where time is spent:
+    reading data (I/O), tokenizing (CPU) or writing tokens (I/O).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.read_time = 0.0
+        self.read_and_tokenize_time = 0.0
+        self.write_time = 0.0
+        self.num_docs = 0
+        self.num_tokens = 0
+        self.num_bytes = 0
+
+    def timed(self, iterable, attribute):
+        """
+        Iterate over an iterable, adding the time spent to get each element to the given attribute.
+        """
+        iterator = iter(iterable)
+        while True:
+            tic = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                setattr(self, attribute, getattr(self, attribute) + time.perf_counter() - tic)
+            yield item
+
+    def as_dict(self, event):
+        elapsed = time.time() - self.start
+        return {
+            "event": event,
+            "date": current_date(),
+            "pid": os.getpid(),
+            "dataset": self.name,
+            "docs": self.num_docs,
+            "tokens": self.num_tokens,
+            "bytes": self.num_bytes,
+            "elapsed": round(elapsed, 3),
+            "read_time": round(self.read_time, 3),
+            "tokenize_time": round(max(0.0, self.read_and_tokenize_time - self.read_time), 3),
+            "write_time": round(self.write_time, 3),
+            "docs_per_sec": round(self.num_docs / elapsed, 1) if elapsed else None,
+            "tokens_per_sec": round(self.num_tokens / elapsed, 1) if elapsed else None,
+            "mb_per_sec": round(self.num_bytes / elapsed / 1024 / 1024, 3) if elapsed else None,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+
+
+def print_metrics_summary(metrics_file, run_id, num_workers, wall_time):
+    """
+    Print a table with the metrics of all the inputs processed in a run (read from the metrics file).
+    """
+    records = []
+    if metrics_file and os.path.exists(metrics_file):
+        with open(metrics_file) as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("run") == run_id and record.get("event") == "done":
+                    records.append(record)
+    if not records:
+        return
+
+    def percent(x, total):
+        return f"{100 * x / total:.0f}%" if total else "-"
+
+    total = {
+        k: sum(record[k] for record in records)
+        for k in ["docs", "tokens", "bytes", "elapsed", "read_time", "tokenize_time", "write_time"]
+    }
+    total.update(dataset="TOTAL", peak_rss_mb=max(record["peak_rss_mb"] for record in records))
+
+    columns = ["dataset", "docs", "Mtokens", "MB", "time", "read", "tokenize", "write", "Ktok/s", "RSS(MB)"]
+    rows = []
+    for r in sorted(records, key=lambda r: -r["elapsed"]) + [total]:
+        rows.append(
+            [
+                r["dataset"],
+                str(r["docs"]),
+                f"{r['tokens'] / 1e6:.1f}",
+                f"{r['bytes'] / 1024 / 1024:.1f}",
+                f"{r['elapsed']:.0f}s",
+                percent(r["read_time"], r["elapsed"]),
+                percent(r["tokenize_time"], r["elapsed"]),
+                percent(r["write_time"], r["elapsed"]),
+                f"{r['tokens'] / r['elapsed'] / 1000:.1f}" if r["elapsed"] else "-",
+                f"{r['peak_rss_mb']:.0f}",
+            ]
+        )
+    widths = [max(len(row[i]) for row in [columns] + rows) for i in range(len(columns))]
+    for row in [columns] + rows:
+        print("  ".join(v.ljust(w) if i == 0 else v.rjust(w) for i, (v, w) in enumerate(zip(row, widths))))
+    print(
+        f"Wall time: {wall_time:.0f}s"
+        f" -- Worker utilization: {percent(total['elapsed'], max(1, num_workers) * wall_time)}"
+        f" -- Throughput: {total['tokens'] / wall_time / 1000:.1f} Ktok/s"
+    )
+
+
+def source_fingerprint(input):
+    """
+    Description of input data (json serializable), used to check whether tokenized outputs are up to date.
+    """
+    if isinstance(input, str):
+        input = JsonlShard(input)
+    if hasattr(input, "fingerprint"):
+        return input.fingerprint()
+    # No way to know if the data changed (ex: list of texts, or streaming dataset)
+    return {"name": str(getattr(input, "name", type(input).__name__))}
+
+
+class LazySourceFingerprint:
+    """
+    Fingerprint of input data, computed only when needed (it can cost a request per remote file):
+    to check outputs with --resume, and to write the manifest of new outputs.
+    """
+
+    def __init__(self, input):
+        self.input = input
+        self._fingerprint = None
+
+    def get(self):
+        if self._fingerprint is None:
+            self._fingerprint = source_fingerprint(self.input)
+        return self._fingerprint
+
+
+def tokenizer_fingerprint(tokenizer):
+    """
+    Hash of the full tokenizer definition (vocabulary, merges, normalizer, pre-tokenizer...).
+    """
+    hf_tokenizer = getattr(tokenizer, "tokenizer", tokenizer)
+    if hasattr(hf_tokenizer, "backend_tokenizer"):
+        content = hf_tokenizer.backend_tokenizer.to_str()
+    else:
+        content = json.dumps(sorted(hf_tokenizer.get_vocab().items()))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def write_json_atomic(filename, data):
+    """
+    Write a json file, such that it is either complete or absent (even if the process is killed while writing).
+    """
+    tmp_filename = f"{filename}.tmp{os.getpid()}"
+    try:
+        with open(tmp_filename, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
 class TokenizationTask:
     def __init__(self, args):
         self.args = args
         self.encoder = None
-        tokenizer = build_tokenizer(self.args)
-        self.vocab_size = tokenizer.vocab_size
-
-    def initializer(self):
+        tic = time.time()
+        # Loaded once in the main process, and given to workers when they start (see initializer())
+        self.tokenizer = build_tokenizer(self.args)
+        print(
+            f"{current_date()} -- Loaded tokenizer from {self.args.tokenizer_name_or_path} in {time.time() - tic:.2f}s"
+        )
+        self.vocab_size = self.tokenizer.vocab_size
+        self.tokenizer_hash = tokenizer_fingerprint(self.tokenizer)
+
+    def __getstate__(self):
+        # The task is sent to workers with each work item: do not serialize the tokenizer each time
+        # (workers get it once, as argument of initializer())
+        state = self.__dict__.copy()
+        state["encoder"] = None
+        state["tokenizer"] = None
+        return state
+
+    def initializer(self, tokenizer=None):
+        """
+        Initialize a worker, with the tokenizer of the main process
+        (inherited when workers are forked, or serialized once per worker when they are spawned).
+        """
+        tic = time.time()
+        first_time = getattr(Encoder, "tokenizer", None) is None
         self.encoder = Encoder(self.args)
-        self.encoder.initializer()
+        self.encoder.initializer(tokenizer if tokenizer is not None else self.tokenizer)
+        if first_time:
+            print(f"{current_date()} -- Worker {os.getpid()} started in {time.time() - tic:.3f}s")
+            sys.stdout.flush()
 
     def print_processing_stats(self, count, proc_start, total_bytes_processed, dataset_name):
         current = time.time()
@@ -151,15 +483,91 @@ class TokenizationTask:
         )
         sys.stdout.flush()
 
-    def process_batch(self, input, output_prefix):
+    def write_metrics(self, record):
+        """
+        Append a record (dictionary) to the metrics file, as a JSON line.
+        """
+        if not self.args.metrics_file:
+            return
+        record = {"run": self.args.run_id, **record}
+        # Lines are small enough to be appended atomically by concurrent processes
+        with open(self.args.metrics_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def output_files(self, output_prefix):
+        level = "document"
+        return [f"{output_prefix}_{key}_{level}{ext}" for key in self.args.json_keys for ext in [".bin", ".idx"]]
+
+    def manifest_file(self, output_prefix):
+        return f"{output_prefix}.manifest.json"
+
+    def manifest(self, output_prefix, source):
+        """
+        Everything that determines the content of tokenized outputs (and the size of the written files)
+        """
+        args = self.args
+        if isinstance(source, LazySourceFingerprint):
+            source = source.get()
+        return {
+            "source": source,
+            "tokenizer": self.tokenizer_hash,
+            "args": {
+                "tokenizer_type": args.tokenizer_type,
+                "json_keys": args.json_keys,
+                "append_eod": args.append_eod,
+                "pad_to": args.pad_to,
+                "dataset_impl": args.dataset_impl,
+            },
+            "files": {
+                os.path.basename(filename): os.path.getsize(filename)
+                for filename in self.output_files(output_prefix)
+                if os.path.exists(filename)
+            },
+        }
+
+    def write_manifest(self, output_prefix, source):
+        write_json_atomic(self.manifest_file(output_prefix), self.manifest(output_prefix, source))
+
+    def is_done(self, output_prefix, source):
+        """
+        Whether tokenized outputs are complete.
+        With --resume, they also have to match their manifest (same source data, tokenizer, options and file sizes).
+        Empty datasets (without output files) are done when they have a manifest.
+        """
+        manifest_file = self.manifest_file(output_prefix)
+        if not self.args.resume:
+            if all(os.path.exists(filename) for filename in self.output_files(output_prefix)):
+                return True
+            if not os.path.exists(manifest_file):
+                return False
+            with open(manifest_file) as f:
+                return not json.load(f)["files"]
+        if not os.path.exists(manifest_file):
+            return False
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        # json round trip, so that tuples and lists compare equal
+        return manifest == json.loads(json.dumps(self.manifest(output_prefix, source)))
+
+    def remove_outputs(self, output_prefix):
+        # Remove the manifest first, so that outputs are never considered as done while being removed
+        for filename in [self.manifest_file(output_prefix)] + self.output_files(output_prefix):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def process_batch(self, input, output_prefix, source=None):
         """
         Process a single json file or a list of text
 
         Args:
-            input: str or list of str
-                input json file or list of text
+            input: str, JsonlShard or list of str
+                input json file (or part of json file) or list of text
             output_prefix: str
                 prefix for output files
+            source: dict or LazySourceFingerprint
+                fingerprint of the source data (by default, the one of input)
+
+        Returns False if the outputs were already there (and nothing was done), True otherwise
         """
 
         # startup_start = time.time()
@@ -169,13 +577,38 @@ class TokenizationTask:
 
         dataset_name = os.path.basename(output_prefix)
 
+        if source is None:
+            source = LazySourceFingerprint(input)
+        if self.is_done(output_prefix, source):
+            # Do not reprocess data that is already here
+            return False
+        # Outputs of an interrupted run, or outdated outputs
+        self.remove_outputs(output_prefix)
+
+        metrics = ProcessingMetrics(dataset_name)
+
+        batch_size = self.args.batch_size
         if isinstance(input, str):
+            input = JsonlShard(input)
+        if isinstance(input, JsonlShard):
             # print("Opening", input)
-            fin = open(input, encoding="utf-8")
-            encoded_docs = map(encoder.encode_json, fin)
+            lines = metrics.timed(input, "read_time")
+            if batch_size > 1:
+                encoded_docs = batched_map(encoder.encode_json_batch, lines, batch_size)
+            else:
+                encoded_docs = map(encoder.encode_json, lines)
+        elif hasattr(input, "iter_batches") and batch_size > 1:
+            # Record batches of parquet files are directly fed to the encoder
+            batches = metrics.timed(input.iter_batches(batch_size), "read_time")
+            encoded_docs = itertools.chain.from_iterable(map(encoder.encode_batch, batches))
         else:
-            fin = None
-            encoded_docs = map(encoder.encode, input)
+            texts = metrics.timed(input, "read_time")
+            if batch_size > 1:
+                encoded_docs = batched_map(encoder.encode_batch, texts, batch_size)
+            else:
+                encoded_docs = map(encoder.encode, texts)
+        # Time spent in this iterator is the time to read and tokenize data
+        encoded_docs = metrics.timed(encoded_docs, "read_and_tokenize_time")
 
         level = "document"
 
@@ -185,9 +618,6 @@ class TokenizationTask:
 
         for key in self.args.json_keys:
             output_bin_files[key] = f"{output_prefix}_{key}_{level}.bin"
-            if output_bin_files[key] and os.path.exists(output_bin_files[key]):
-                # Do not reprocess data that is already here
-                return
             output_idx_files[key] = f"{output_prefix}_{key}_{level}.idx"
             builders[key] = indexed_dataset.make_builder(
                 output_bin_files[key], impl=self.args.dataset_impl, vocab_size=self.vocab_size
@@ -200,10 +630,15 @@ class TokenizationTask:
         i = -1
         for i, (doc, sentence_lens, bytes_processed) in enumerate(encoded_docs, start=1):
             total_bytes_processed += bytes_processed
+            tic = time.perf_counter()
             for key in doc.keys():
                 builders[key].add_doc(doc[key], sentence_lens[key])
+                metrics.num_tokens += len(doc[key])
+            metrics.write_time += time.perf_counter() - tic
             if i % self.args.log_interval == 0:
                 self.print_processing_stats(i, proc_start, total_bytes_processed, dataset_name)
+                metrics.num_docs, metrics.num_bytes = i, total_bytes_processed
+                self.write_metrics(metrics.as_dict("progress"))
 
         # Do not fail on empty dataset (can happen when filtering documents)
         if i < 0:
@@ -213,30 +648,50 @@ class TokenizationTask:
                 filename = output_bin_files[key]
                 if os.path.exists(filename):
                     os.remove(filename)
-            return
+            # Manifest without output files, so that --resume does not process the dataset again
+            self.write_manifest(output_prefix, source)
+            self.write_metrics(metrics.as_dict("done"))
+            return True
 
         assert i >= 0, f"Error: {input} is empty."
         self.print_processing_stats(i, proc_start, total_bytes_processed, dataset_name)
 
+        tic = time.perf_counter()
         builders[key].finalize(output_idx_files[key])
+        self.write_manifest(output_prefix, source)
+        metrics.write_time += time.perf_counter() - tic
+        metrics.num_docs, metrics.num_bytes = i, total_bytes_processed
+        self.write_metrics(metrics.as_dict("done"))
+        return True
 
-        if fin is not None:
-            fin.close()
+    def process_dataset(self, work_item, use_jsonl_file=False):
+        """
+        Process a whole dataset, where work_item is a tuple (dataset_name, dataset).
 
-    def process_dataset(self, dataset_name, use_jsonl_file=False):
+        The dataset can be a jsonl file, or a (lazy) data iterator, which is only opened here.
+
+        Returns a tuple (dataset_name, success, skipped), where skipped is True if nothing had to be done
+        """
         global error_flag, num_processes
 
+        dataset_name, dataset = work_item
+
         if error_flag.value and self.args.stop_if_failed:
-            return
+            return dataset_name, False, False
 
         remove_jsonl = self.args.remove_jsonl
         has_increased_num_processes = False
+        success = False
+        skipped = False
 
         try:
-            global all_datas
-            dataset = all_datas[dataset_name]
-
-            expected_file = os.path.join(self.args.output_folder, dataset_name + "_text_document.bin")
+            output_prefix = os.path.join(self.args.output_folder, dataset_name)
+            source = LazySourceFingerprint(dataset)
+            if hasattr(dataset, "can_shard") and dataset.can_shard():
+                # Read texts directly from the parquet files (in one piece),
+                # rather than through a (datasets) streaming iterator or a temporary jsonl file
+                dataset = dataset.shard(num_shards=1, index=0)
+                use_jsonl_file = False
             if isinstance(dataset, str):
                 jsonl_file = dataset
                 assert os.path.exists(jsonl_file), f"Error: {jsonl_file} does not exist."
@@ -247,10 +702,10 @@ class TokenizationTask:
                 else:
                     jsonl_file = None
 
-            if os.path.exists(expected_file) and self.args.remove_jsonl:
+            if self.args.remove_jsonl and self.is_done(output_prefix, source):
                 # print(f"Skipping {jsonl_file} as {expected_file} exists.")
                 sys.stdout.flush()
-                return
+                return dataset_name, True, True
 
             if jsonl_file and not os.path.exists(jsonl_file):
                 print(f"Writing {jsonl_file}...")
@@ -267,18 +722,15 @@ class TokenizationTask:
                 print(f"Wrote {jsonl_file} in {time.time() - tic:.2f}s")
                 sys.stdout.flush()
 
-            all_datas.pop(dataset_name)
-
-            if os.path.exists(expected_file):
+            if self.is_done(output_prefix, source):
                 # print(f"Skipping {jsonl_file} as {expected_file} exists.")
                 sys.stdout.flush()
-                return
+                return dataset_name, True, True
 
             num_processes.value += 1
             has_increased_num_processes = True
 
             os.makedirs(self.args.output_folder, exist_ok=True)
-            output_prefix = os.path.join(self.args.output_folder, dataset_name)
 
             if jsonl_file:
                 del dataset
@@ -288,7 +740,7 @@ class TokenizationTask:
                 )
                 sys.stdout.flush()
 
-                self.process_batch(jsonl_file, output_prefix)
+                self.process_batch(jsonl_file, output_prefix, source=source)
                 print(f"{current_date()} -- Processed {jsonl_file}...")
                 sys.stdout.flush()
 
@@ -299,11 +751,13 @@ class TokenizationTask:
                 print(f"{current_date()} -- Processing {dataset_name} ({num_processes.value} processes)")
                 sys.stdout.flush()
 
-                self.process_batch(dataset, output_prefix)
+                self.process_batch(dataset, output_prefix, source=source)
                 print(f"{current_date()} -- Processed {dataset_name}...")
                 sys.stdout.flush()
                 del dataset
 
+            success = True
+
         except (Exception, KeyboardInterrupt) as err:
             import traceback
 
@@ -320,6 +774,124 @@ class TokenizationTask:
             num_processes.value -= 1
             has_increased_num_processes = False
 
+        return dataset_name, success, skipped
+
+    def shard_prefix(self, dataset_name, shard_index, num_shards):
+        return os.path.join(
+            self.args.output_folder, "partitions", f"{dataset_name}--part{shard_index+1:03d}-of{num_shards:03d}"
+        )
+
+    def process_dataset_shard(self, work_item):
+        """
+        Process a part of a dataset, where work_item is a tuple (dataset_name, dataset, shard_index, num_shards).
+
+        Jsonl files are split in byte ranges, parquet files in contiguous row groups.
+        Partial *.bin/*.idx files are written in a "partitions" sub-folder,
+        and have to be merged with merge_dataset_shards() once all parts are processed.
+        Datasets that cannot be split are entirely processed with the first part.
+
+        Returns a tuple (dataset_name, success, skipped), where skipped is True if nothing had to be done
+        """
+        global error_flag, num_processes
+
+        dataset_name, dataset, shard_index, num_shards = work_item
+
+        if error_flag.value and self.args.stop_if_failed:
+            return dataset_name, False, False
+
+        has_increased_num_processes = False
+        success = False
+        skipped = False
+
+        try:
+            if self.is_done(os.path.join(self.args.output_folder, dataset_name), LazySourceFingerprint(dataset)):
+                return dataset_name, True, True
+
+            if isinstance(dataset, str):
+                assert os.path.exists(dataset), f"Error: {dataset} does not exist."
+                shard = JsonlShard(dataset, num_shards, shard_index)
+                output_prefix = self.shard_prefix(dataset_name, shard_index, num_shards)
+            elif hasattr(dataset, "can_shard") and dataset.can_shard():
+                shard = dataset.shard(num_shards, shard_index)
+                output_prefix = self.shard_prefix(dataset_name, shard_index, num_shards)
+            elif shard_index == 0:
+                shard = dataset
+                output_prefix = os.path.join(self.args.output_folder, dataset_name)
+            else:
+                return dataset_name, True, True
+
+            num_processes.value += 1
+            has_increased_num_processes = True
+
+            os.makedirs(os.path.dirname(output_prefix), exist_ok=True)
+
+            print(f"{current_date()} -- Processing {shard} -> {dataset_name} ({num_processes.value} processes)")
+            sys.stdout.flush()
+
+            skipped = not self.process_batch(shard, output_prefix)
+            print(f"{current_date()} -- Processed {shard}...")
+            sys.stdout.flush()
+            success = True
+
+        except (Exception, KeyboardInterrupt) as err:
+            import traceback
+
+            print(traceback.format_exc())
+            print(f"{current_date()} -- Error processing {dataset_name} (part {shard_index+1}/{num_shards}): {err}")
+            sys.stdout.flush()
+            if error_flag is not None:
+                error_flag.value = True
+
+        if has_increased_num_processes:
+            num_processes.value -= 1
+
+        return dataset_name, success, skipped
+
+    def merge_dataset_shards(self, dataset_name, dataset, num_shards):
+        """
+        Concatenate (in order) the partial *.bin/*.idx files written by process_dataset_shard(), and remove them.
+        """
+        output_prefix = os.path.join(self.args.output_folder, dataset_name)
+        source = LazySourceFingerprint(dataset)
+        if self.is_done(output_prefix, source):
+            return
+        self.remove_outputs(output_prefix)
+        level = "document"
+        for key in self.args.json_keys:
+            output_bin_file = f"{output_prefix}_{key}_{level}.bin"
+            output_idx_file = f"{output_prefix}_{key}_{level}.idx"
+            parts = []
+            for shard_index in range(num_shards):
+                part = f"{self.shard_prefix(dataset_name, shard_index, num_shards)}_{key}_{level}"
+                if os.path.exists(part + ".idx"):
+                    parts.append(part)
+                else:
+                    # Can happen with empty parts (or when there are less row groups than parts)
+                    assert not os.path.exists(part + ".bin"), f"Error: {part}.bin is incomplete."
+            if not parts:
+                print(f"WARNING: {dataset_name} is empty.")
+                continue
+
+            print(f"{current_date()} -- Merging {len(parts)} parts -> {output_bin_file}")
+            sys.stdout.flush()
+            builder = indexed_dataset.make_builder(
+                output_bin_file, impl=self.args.dataset_impl, vocab_size=self.vocab_size
+            )
+            try:
+                for part in parts:
+                    builder.merge_file_(part)
+                builder.finalize(output_idx_file)
+            except (Exception, KeyboardInterrupt) as err:
+                for filename in [output_bin_file, output_idx_file]:
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                raise err
+
+        self.write_manifest(output_prefix, source)
+
+        for shard_index in range(num_shards):
+            self.remove_outputs(self.shard_prefix(dataset_name, shard_index, num_shards))
+
 
 global error_flag
 error_flag = multiprocessing.Value("b", False)
@@ -327,7 +899,7 @@ global num_processes
 num_processes = multiprocessing.Value("i", 0)
 
 
-def get_args():
+def get_args(argv=None):
     parser = argparse.ArgumentParser(
         description="Tokenize and encode text data for pretraining.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -335,6 +907,12 @@ def get_args():
     group = parser.add_argument_group(title="input data")
     group.add_argument("--datasets", type=str, default="all", help="Datasets", nargs="+")
     group.add_argument("--high-quality", default=False, action="store_true", help="Use high quality data only")
+    group.add_argument(
+        "--data-folder",
+        type=str,
+        default=None,
+        help="Local copy of the dataset repository, where parquet files are read from (instead of the Hub)",
+    )
     group.add_argument(
         "--json-keys", nargs="+", default=["text"], help="space separate listed of keys to extract from json"
     )
@@ -370,8 +948,15 @@ def get_args():
     group = parser.add_argument_group(title="output data")
     group.add_argument("--output-folder", type=str, default="tokenized_data", help="Output folder")
     group.add_argument("--jsonl-folder", type=str, default="tmp_to_tokenize", help="Folder with jsonl files")
-    group.add_argument("--dataset-impl", type=str, default="mmap", choices=["lazy", "cached", "mmap"])
+    group.add_argument("--dataset-impl", type=str, default="mmap", choices=["mmap"])
     group.add_argument("--stop-if-failed", default=False, action="store_true", help="Stop if an error occurs")
+    group.add_argument(
+        "--resume",
+        default=False,
+        action="store_true",
+        help="Only skip outputs whose manifest (*.manifest.json) matches the current source data, tokenizer and options"
+        " (other outputs are tokenized again)",
+    )
     group.add_argument(
         "--pad-to",
         default=None,
@@ -386,17 +971,58 @@ def get_args():
         type=int,
         default=10,
         help=(
-            "Number of worker processes to launch."
+            "Number of worker processes to launch. "
             "A good default for fast pre-processing "
-            "is: (workers * partitions) = available CPU cores."
+            "is: (workers * threads_tokenization) = available CPU cores."
         ),
     )
     group.add_argument(
-        "--threads_tokenization", type=int, default=1, help="Number of sub-threads for tokenizing each subset part"
+        "--threads_tokenization",
+        type=int,
+        default=1,
+        help="Number of sub-threads for tokenizing each batch of documents (with --batch-size > 1)",
+    )
+    group.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="Number of documents tokenized at once (1 to tokenize documents one by one)",
+    )
+    group.add_argument(
+        "--partitions",
+        type=int,
+        default=1,
+        help="Number of parts in which each dataset is split, to be processed in parallel and merged at the end",
+    )
+    group.add_argument(
+        "--max-len-at-once",
+        type=int,
+        default=None,
+        help="Documents with more characters are tokenized by chunks (split before digits), to limit memory and time",
+    )
+    group.add_argument(
+        "--check-long-documents",
+        default=False,
+        action="store_true",
+        help="Check that documents tokenized by chunks (see --max-len-at-once) get the same tokens"
+        " as when tokenized at once, and print a warning otherwise (slow, for validation only)",
+    )
+    group.add_argument(
+        "--stats-folder",
+        type=str,
+        default=DEFAULT_STATS_FOLDER,
+        help="Folder with statistics of datasets (stats_*.json), used to process the largest datasets first"
+        " and to predict the completion time (empty string to use only the size of local files)",
     )
-    group.add_argument("--partitions", type=int, default=1, help="Number of file partitions")
     group.add_argument("--log-interval", type=int, default=1000, help="Interval between progress updates")
-    args = parser.parse_args()
+    group.add_argument(
+        "--metrics-file",
+        type=str,
+        default=None,
+        help="File where metrics (timings, throughput, memory...) are appended as JSON lines"
+        " (default: metrics.jsonl in the output folder, empty string to disable)",
+    )
+    args = parser.parse_args(argv)
 
     args.keep_empty = False
 
@@ -427,11 +1053,20 @@ def main():
 
         tokenizer = transformers.AutoTokenizer.from_pretrained(args.tokenizer_name_or_path)
         tokenizer.save_pretrained(tokenizer_folder)
+        del tokenizer
+        if args.tokenizer_type == "PretrainedFromHF":
+            # Load the local copy from now on (rather than querying the Hub again)
+            args.tokenizer_name_or_path = tokenizer_folder
 
     args.remove_jsonl = "tmp" in args.jsonl_folder
-
-    global all_datas
-    all_datas = get_datasets(args.datasets, high_quality=args.high_quality)
+    args.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    if args.metrics_file is None:
+        args.metrics_file = os.path.join(args.output_folder, "metrics.jsonl")
+    if args.metrics_file:
+        print(f"Metrics: {args.metrics_file} (run {args.run_id})")
+
+    # Datasets are only described here (lazy=True), and opened by the worker that processes them
+    all_datas = get_datasets(args.datasets, high_quality=args.high_quality, lazy=True, data_folder=args.data_folder)
     all_datas = dict(dataset_to_key_value(dataset) for dataset in decompose_datasets(all_datas))
 
     task = TokenizationTask(args)
@@ -442,18 +1077,71 @@ def main():
     # # Shared flag to indicate if an error occurred in any process
     # error_flag = multiprocessing.Value('b', False)
 
-    all_data_names = list(all_datas.keys())
-    # Suffle the data names to avoid processing the largest datasets first
-    random.shuffle(all_data_names)
+    # Process the largest datasets first (LPT scheduling), so that they do not end up running alone at the end
+    dataset_sizes = estimate_sizes(all_datas, args.stats_folder)
+    all_data_names = sorted(all_datas.keys(), key=lambda name: dataset_sizes[name], reverse=True)
+
+    if args.partitions > 1:
+        # Split each dataset in several parts, that are processed in parallel and merged at the end
+        work_items = [
+            (name, all_datas[name], i, args.partitions) for name in all_data_names for i in range(args.partitions)
+        ]
+        process_function = task.process_dataset_shard
+    else:
+        work_items = [(name, all_datas[name]) for name in all_data_names]
+        process_function = task.process_dataset
+    # Work items are handed out one at a time, to the first available worker
+    # (which also makes sure the parts of a dataset are dispatched to different workers)
+    chunk_size = 1
+
+    num_parts_done = {}
+    num_results = 0
+    run_start = time.time()
+    item_sizes = [dataset_sizes[item[0]] / args.partitions for item in work_items]
+    predictor = CompletionTimePredictor(item_sizes, args.workers, run_start)
+    print(f"Estimated size: {predictor.total_size / 1e9:.2f}G characters ({predictor.makespan / 1e9:.2f}G per worker)")
+
+    def log_queue(result):
+        nonlocal num_results
+        num_results += 1
+        dataset_name, _, skipped = result
+        predicted_time = predictor.update(dataset_sizes[dataset_name] / args.partitions, time.time(), skipped=skipped)
+        task.write_metrics(
+            {
+                "event": "queue",
+                "date": current_date(),
+                "pending": len(work_items) - num_results,
+                "active": num_processes.value,
+                "done_chars": round(predictor.done_size),
+                "skipped_chars": round(predictor.skipped_size),
+                "predicted_time": round(predicted_time, 1) if predicted_time else None,
+            }
+        )
+
+    def is_last_part(result):
+        if args.partitions <= 1:
+            return False
+        dataset_name, success, _ = result
+        if not success:
+            return False
+        num_parts_done[dataset_name] = num_parts_done.get(dataset_name, 0) + 1
+        return num_parts_done[dataset_name] == args.partitions
 
     if args.workers > 1:
-        with multiprocessing.Pool(processes=args.workers, initializer=task.initializer) as pool:  # , maxtasksperchild=1
+        with multiprocessing.Pool(
+            processes=args.workers, initializer=task.initializer, initargs=(task.tokenizer,)
+        ) as pool:  # , maxtasksperchild=1
             # Partially apply the process function with error_flag argument
             # import functools
             # process_dataset = functools.partial(task.process_dataset, error_flag=error_flag)
 
-            chunk_size = max(1, len(all_datas) // args.workers)
-            for _ in pool.imap_unordered(task.process_dataset, all_data_names, chunk_size):
+            merges = []
+            for result in pool.imap_unordered(process_function, work_items, chunk_size):
+                log_queue(result)
+                if is_last_part(result):
+                    merges.append(
+                        pool.apply_async(task.merge_dataset_shards, (result[0], all_datas[result[0]], args.partitions))
+                    )
                 # Check if any error occurred
                 if error_flag.value:
                     # If an error occurred, terminate all processes in the pool
@@ -464,14 +1152,37 @@ def main():
                     print("Terminating all processes.")
                     pool.terminate()
                     break
+            else:
+                for merge in merges:
+                    merge.get()
     else:
-        for _ in map(task.process_dataset, all_data_names):
+        for result in map(process_function, work_items):
+            log_queue(result)
+            if is_last_part(result):
+                task.merge_dataset_shards(result[0], all_datas[result[0]], args.partitions)
             if error_flag.value:
                 if args.stop_if_failed:
                     break
                 else:
                     continue
 
+    wall_time = time.time() - run_start
+    if predictor.first_prediction:
+        print(
+            f"Completion time: predicted {predictor.first_prediction:.0f}s"
+            f" (after {predictor.fraction_for_prediction:.0%} of the data), actual {wall_time:.0f}s"
+        )
+    task.write_metrics(
+        {
+            "event": "schedule",
+            "date": current_date(),
+            "estimated_chars": round(predictor.total_size),
+            "predicted_time": round(predictor.first_prediction, 1) if predictor.first_prediction else None,
+            "actual_time": round(wall_time, 1),
+        }
+    )
+    print_metrics_summary(args.metrics_file, args.run_id, args.workers, wall_time)
+
 
 if __name__ == "__main__":
     main()
@@ -1,11 +1,23 @@
 # This script is inspired from the original script of the Croissant team :
 # https://github.com/ManuelFay/llm-data-hub/blob/ea9c84708f00f61320ea352998e6af999aa71c24/dataset_construction/fit_tokenizer.py
 
+import collections
+import glob
 import itertools
 import json
+import multiprocessing
+import os
+import queue
 import re
+import secrets
+import time
+import traceback
+from multiprocessing import resource_tracker, shared_memory
 from typing import Optional
 
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import tokenizers
 import transformers
 
@@ -254,18 +266,22 @@ def fit_tokenizer(
     limit_alphabet=1000,
     enforce_alphabet=False,
     batch_size=1000,
+    num_producers=1,
+    word_counts=None,
     **special_tokens_options,
 ):
     """
     Fit a tokenizer on a dataset.
     :param tokenizer: The tokenizer to fit.
-    :param it: Generator of texts.
+    :param it: Generator of texts (ignored if word_counts is given).
     :param len_it: Length of the generator (optional, only used for the progress bar).
     :param vocab_size: Size of the vocabulary.
     :param limit_alphabet: Limit the alphabet size
         (unique characters in the dataset, except from special enforced ones).
     :param enforce_alphabet: Experimental
     :param batch_size: Size of the batches.
+    :param num_producers: Number of processes reading the texts in parallel (see parallel_batch_iterator).
+    :param word_counts: Pre-tokenized words and their counts (see load_word_counts), to use instead of texts.
     :return: The fitted tokenizer.
     """
 
@@ -320,7 +336,11 @@ def fit_tokenizer(
         limit_alphabet=1000,
         initial_alphabet=initial_alphabet,
     )
-    tokenizer.train_from_iterator(batchify_iterator(it, batch_size=batch_size), trainer=bpe_trainer, length=len_it)
+    if word_counts is not None:
+        return train_from_word_counts(tokenizer, bpe_trainer, *word_counts)
+    tokenizer.train_from_iterator(
+        training_batches(it, batch_size=batch_size, num_producers=num_producers), trainer=bpe_trainer, length=len_it
+    )
     return tokenizer
 
 
@@ -330,6 +350,7 @@ def refit_tokenizer(
     len_it=None,
     vocab_size=32000,
     batch_size=1000,
+    num_producers=1,
     **special_tokens_options,
 ):
     """
@@ -339,6 +360,7 @@ def refit_tokenizer(
     :param len_it: Length of the generator (optional, only used for the progress bar).
     :param vocab_size: Size of the vocabulary.
     :param batch_size: Size of the batches.
+    :param num_producers: Number of processes reading the texts in parallel (see parallel_batch_iterator).
     :return: The fitted tokenizer.
     """
 
@@ -347,7 +369,7 @@ def refit_tokenizer(
     tokenizer._tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Digits(individual_digits=True)
 
     tokenizer = tokenizer.train_new_from_iterator(
-        batchify_iterator(it, batch_size=batch_size),
+        training_batches(it, batch_size=batch_size, num_producers=num_producers),
         vocab_size=vocab_size,
         length=len_it,
         new_special_tokens=new_special_tokens,
@@ -373,6 +395,338 @@ def batchify_iterator(it, batch_size=1000):
         yield batch
 
 
+def training_batches(it, batch_size=1000, num_producers=1):
+    """
+    Batches of texts to train a tokenizer, read by several processes if possible.
+    """
+    if num_producers > 1 and hasattr(it, "can_shard") and it.can_shard():
+        return parallel_batch_iterator(it, num_producers, batch_size=batch_size)
+    if num_producers > 1:
+        print(f"Warning: cannot read {getattr(it, 'name', 'data')} in parallel (not sharded parquet files)")
+    return batchify_iterator(it, batch_size=batch_size)
+
+
+def parallel_batch_iterator(it, num_producers, batch_size=1000, queue_size=None, timeout=10):
+    """
+    Batchify an iterator that can be sharded (DataIterator or ParquetDataIterator on parquet files),
+    with num_producers processes that each read a shard of the data.
+
+    Batches are written in shared memory by the producers, and only their description goes through a bounded queue.
+    At the end, a report of the time spent waiting by producers (full queue) and by the consumer (empty queue)
+    tells which side is the bottleneck.
+    :param it: The iterator to batchify.
+    :param num_producers: Number of producer processes.
+    :param batch_size: The size of the batches.
+    :param queue_size: Maximum number of batches waiting in the queue (default: 4 per producer).
+    :param timeout: Time (in seconds) after which producers are checked, when no batch comes.
+    :return: The batchified iterator (batches come in no particular order).
+    """
+    if queue_size is None:
+        queue_size = 4 * num_producers
+    context = multiprocessing.get_context("fork")
+    # Shared memory blocks are created by producers and released by the consumer: they must share a resource tracker
+    resource_tracker.ensure_running()
+    batches = context.Queue(maxsize=queue_size)
+    stop = context.Event()
+    # Blocks are named after their producer and their rank, so that the ones that were never received can be released
+    block_prefix = f"lucie_{os.getpid()}_{secrets.token_hex(4)}"
+    producers = [
+        context.Process(
+            target=_produce_batches,
+            args=(i, it.shard(num_producers, i), batch_size, batches, stop, f"{block_prefix}_{i}"),
+            daemon=True,
+        )
+        for i in range(num_producers)
+    ]
+    for producer in producers:
+        producer.start()
+
+    tic = time.perf_counter()
+    consumer_wait_time = 0
+    producer_stats = {}
+    num_batches = 0
+    # Number of batches received from each producer
+    num_received = [0] * num_producers
+    # Producers that had exited (without saying they were done) when the queue was found empty
+    dead_producers = set()
+    try:
+        while len(producer_stats) < num_producers:
+            tic_wait = time.perf_counter()
+            try:
+                message = batches.get(timeout=timeout)
+            except queue.Empty:
+                # A producer killed by a signal (ex: out of memory) never sends "done" or "error".
+                # All the messages of a dead producer are in the queue: if it was already dead at the previous timeout,
+                # it did not finish its shard.
+                consumer_wait_time += time.perf_counter() - tic_wait
+                dead = {
+                    i for i, producer in enumerate(producers) if i not in producer_stats and not producer.is_alive()
+                }
+                failed = sorted(dead & dead_producers)
+                if failed:
+                    exit_codes = ", ".join(str(producers[i].exitcode) for i in failed)
+                    raise RuntimeError(
+                        f"{len(failed)} producer(s) of training data exited before the end of their shard"
+                        f" (exit code: {exit_codes})"
+                    ) from None
+                dead_producers = dead
+                continue
+            consumer_wait_time += time.perf_counter() - tic_wait
+            if message[0] == "error":
+                raise RuntimeError(f"Error in a producer of training data:\n{message[2]}")
+            if message[0] == "done":
+                producer_stats[message[1]] = message[2]
+                continue
+            _, index, name, num_texts, num_bytes = message
+            num_received[index] += 1
+            yield _read_shared_batch(name, num_texts, num_bytes)
+            num_batches += 1
+    finally:
+        # If iteration was interrupted, stop the producers, and release the batches that were not consumed
+        stop.set()
+        while any(producer.is_alive() for producer in producers):
+            try:
+                message = batches.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if message[0] == "batch":
+                num_received[message[1]] += 1
+                _read_shared_batch(*message[2:])
+        for producer in producers:
+            producer.join()
+        # Blocks whose message was not received (ex: lost when a producer was killed)
+        for i in range(num_producers):
+            _release_shared_batches(f"{block_prefix}_{i}", num_received[i])
+
+    producer_stats = list(producer_stats.values())
+    total_time = time.perf_counter() - tic
+    read_time = sum(stats["read_time"] for stats in producer_stats) / num_producers
+    producer_wait_time = sum(stats["wait_time"] for stats in producer_stats) / num_producers
+    print(
+        f"Training data: {num_batches} batches read by {num_producers} processes in {total_time:.1f}s"
+        f" -- producers: {read_time:.1f}s reading, {producer_wait_time:.1f}s waiting for a full queue (on average)"
+        f" -- trainer: {consumer_wait_time:.1f}s waiting for data ({100 * consumer_wait_time / total_time:.0f}%)"
+    )
+    if consumer_wait_time > producer_wait_time:
+        print("The trainer was waiting for data: more producers may help (--num_producers)")
+    else:
+        print("Producers were waiting for the trainer: less producers may be enough (--num_producers)")
+
+
+def _produce_batches(index, shard, batch_size, batches, stop, block_prefix):
+    stats = {"read_time": 0, "wait_time": 0}
+    try:
+        tic = time.perf_counter()
+        for rank, texts in enumerate(shard.iter_batches(batch_size)):
+            if stop.is_set():
+                break
+            # Batch layout in shared memory: lengths of the texts (int64), then the concatenated texts (utf-8)
+            lengths = np.array([len(text) for text in texts], dtype=np.int64)
+            data = "".join(texts).encode("utf-8")
+            shm = shared_memory.SharedMemory(
+                name=f"{block_prefix}_{rank}", create=True, size=max(1, lengths.nbytes + len(data))
+            )
+            shm.buf[: lengths.nbytes] = lengths.tobytes()
+            shm.buf[lengths.nbytes : lengths.nbytes + len(data)] = data
+            shm.close()
+            stats["read_time"] += time.perf_counter() - tic
+            tic = time.perf_counter()
+            batches.put(("batch", index, shm.name, len(texts), len(data)))
+            stats["wait_time"] += time.perf_counter() - tic
+            tic = time.perf_counter()
+        batches.put(("done", index, stats))
+    except (Exception, KeyboardInterrupt):
+        batches.put(("error", index, traceback.format_exc()))
+
+
+def _read_shared_batch(name, num_texts, num_bytes):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        lengths = np.frombuffer(shm.buf, dtype=np.int64, count=num_texts).tolist()
+        start = 8 * num_texts
+        data = bytes(shm.buf[start : start + num_bytes]).decode("utf-8")
+    finally:
+        shm.close()
+        shm.unlink()
+    texts = []
+    offset = 0
+    for length in lengths:
+        texts.append(data[offset : offset + length])
+        offset += length
+    return texts
+
+
+def _release_shared_batches(block_prefix, start):
+    """
+    Unlink the shared memory blocks of a producer from the given rank (batches that were never read).
+    """
+    rank = start
+    while True:
+        try:
+            shm = shared_memory.SharedMemory(name=f"{block_prefix}_{rank}")
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+        rank += 1
+
+
+def pre_tokenization_config(tokenizer):
+    """
+    Configuration of the normalizer and pre-tokenizer of a tokenizer (what the pre-tokenized words depend on).
+    """
+    config = json.loads(tokenizer.to_str())
+    return {"normalizer": config["normalizer"], "pre_tokenizer": config["pre_tokenizer"]}
+
+
+def count_words(tokenizer, texts):
+    """
+    Count the words of texts, after normalization and pre-tokenization (as the trainer of a tokenizer does).
+    """
+    counts = collections.Counter()
+    normalizer = tokenizer.normalizer
+    pre_tokenizer = tokenizer.pre_tokenizer
+    for text in texts:
+        if normalizer is not None:
+            text = normalizer.normalize_str(text)
+        if pre_tokenizer is not None:
+            counts.update(word for word, _ in pre_tokenizer.pre_tokenize_str(text))
+        else:
+            counts[text] += 1
+    return counts
+
+
+def compute_word_counts(tokenizer, it, folder, num_processes=1):
+    """
+    Count the pre-tokenized words of a dataset, and save the counts in a folder.
+
+    Counts are saved in parquet files (one per shard of the data, columns "word" and "count"),
+    with the configuration of the normalizer and pre-tokenizer, and the fingerprint of the data, in their metadata.
+    Shards computed separately (ex: on different machines) can be gathered in a same folder (see load_word_counts).
+    """
+    if num_processes > 1 and hasattr(it, "can_shard") and it.can_shard():
+        shards = [it.shard(num_processes, i) for i in range(num_processes)]
+    else:
+        shards = [it]
+    os.makedirs(folder, exist_ok=True)
+    trainset = trainset_fingerprint(it)
+    work_items = [
+        (
+            tokenizer.to_str(),
+            trainset,
+            shard,
+            os.path.join(folder, f"word_counts-{i+1:03d}-of-{len(shards):03d}.parquet"),
+        )
+        for i, shard in enumerate(shards)
+    ]
+    if len(work_items) > 1:
+        with multiprocessing.get_context("fork").Pool(len(work_items)) as pool:
+            pool.map(_compute_word_counts, work_items)
+    else:
+        _compute_word_counts(work_items[0])
+
+
+def _compute_word_counts(work_item):
+    tokenizer_config, trainset, texts, filename = work_item
+    tokenizer = tokenizers.Tokenizer.from_str(tokenizer_config)
+    counts = count_words(tokenizer, texts)
+    words = sorted(counts)
+    table = pa.table({"word": words, "count": pa.array([counts[w] for w in words], type=pa.int64())})
+    table = table.replace_schema_metadata(
+        {"pre_tokenization": json.dumps(pre_tokenization_config(tokenizer)), "trainset": json.dumps(trainset)}
+    )
+    pq.write_table(table, filename + ".tmp", compression="zstd")
+    os.replace(filename + ".tmp", filename)
+
+
+def trainset_fingerprint(it):
+    """
+    Fingerprint of training data (json serializable), or None if it cannot be known (ex: a generator of texts).
+    """
+    return it.fingerprint() if hasattr(it, "fingerprint") else None
+
+
+def word_counts_filenames(folder):
+    """
+    Return the files of word counts saved by compute_word_counts() in a folder (empty list if there are none).
+
+    Raise an error if some shards are missing (ex: counting was interrupted, or not all shards were gathered).
+    """
+    filenames = sorted(glob.glob(os.path.join(folder, "word_counts-*-of-*.parquet")))
+    if not filenames:
+        return []
+    shards = collections.defaultdict(set)
+    for filename in filenames:
+        match = re.fullmatch(r"word_counts-(\d+)-of-(\d+)\.parquet", os.path.basename(filename))
+        if match:
+            shards[int(match.group(2))].add(int(match.group(1)))
+    if len(shards) != 1:
+        raise RuntimeError(f"Word counts in {folder} come from different numbers of shards: {sorted(shards)}")
+    ((num_shards, indices),) = shards.items()
+    missing = sorted(set(range(1, num_shards + 1)) - indices)
+    if missing:
+        raise RuntimeError(f"Missing word counts in {folder}: shards {missing} (of {num_shards})")
+    return filenames
+
+
+def load_word_counts(folder, tokenizer=None, trainset=None):
+    """
+    Load and merge word counts saved by compute_word_counts().
+
+    :param tokenizer: if given, check that counts were computed with the same normalizer and pre-tokenizer
+    :param trainset: if given, check that counts were computed on the same data
+    :return: a tuple (words, counts)
+    """
+    filenames = word_counts_filenames(folder)
+    if not filenames:
+        raise FileNotFoundError(f"No word counts in {folder}")
+    expected_config = pre_tokenization_config(tokenizer) if tokenizer is not None else None
+    # (json round trip, for the comparison with the fingerprint read from the files)
+    expected_trainset = json.loads(json.dumps(trainset_fingerprint(trainset))) if trainset is not None else None
+    tables = []
+    for filename in filenames:
+        table = pq.read_table(filename)
+        config = json.loads(table.schema.metadata[b"pre_tokenization"])
+        if expected_config is not None and config != expected_config:
+            raise RuntimeError(f"Word counts in {filename} were computed with another normalizer or pre-tokenizer")
+        if (
+            expected_trainset is not None
+            and json.loads(table.schema.metadata.get(b"trainset", b"null")) != expected_trainset
+        ):
+            raise RuntimeError(f"Word counts in {filename} were computed on other training data")
+        tables.append(table.replace_schema_metadata(None))
+    table = pa.concat_tables(tables).group_by("word").aggregate([("count", "sum")])
+    return table.column("word").to_pylist(), table.column("count_sum").to_pylist()
+
+
+def train_from_word_counts(tokenizer, trainer, words, counts, max_sequence_length=1_000_000):
+    """
+    Train a tokenizer from pre-tokenized words and their counts, rather than from texts.
+
+    The trainer of the tokenizers library only accepts texts: words are given (as many times as they occur)
+    to a copy of the tokenizer without normalizer, that just splits texts on a separator.
+    This gives the same result as training on the original texts, without reading, normalizing and pre-tokenizing them.
+    """
+    separator = next(c for c in "\x00\x01\uffff\U0010ffff" if not any(c in word for word in words))
+    replay_tokenizer = tokenizers.Tokenizer.from_str(tokenizer.to_str())
+    replay_tokenizer.normalizer = tokenizers.normalizers.Sequence([])
+    replay_tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Split(separator, behavior="removed")
+
+    def sequences():
+        for word, count in zip(words, counts):
+            word += separator
+            repeat = max(1, max_sequence_length // len(word))
+            for _ in range(count // repeat):
+                yield word * repeat
+            if count % repeat:
+                yield word * (count % repeat)
+
+    replay_tokenizer.train_from_iterator(batchify_iterator(sequences()), trainer=trainer)
+    replay_tokenizer.normalizer = tokenizer.normalizer
+    replay_tokenizer.pre_tokenizer = tokenizer.pre_tokenizer
+    return replay_tokenizer
+
+
 def test_tokenizer(tokenizer, sentence):
     if isinstance(sentence, list):
         return [test_tokenizer(tokenizer, s) for s in sentence]
@@ -556,10 +910,8 @@ def add_consecutive_spaces(
 
 if __name__ == "__main__":
     import argparse
-    import os
     import shutil
     import sys
-    import time
 
     def str2bool(s):
         s = s.lower()
@@ -636,6 +988,19 @@ if __name__ == "__main__":
         action="store_true",
         help="Overwrite output folder if it already exists",
     )
+    parser.add_argument(
+        "--word_counts",
+        default=None,
+        type=str,
+        help="Folder with counts of pre-tokenized words, computed once (if missing) and re-used to train from scratch"
+        " (ex: with different vocabulary sizes)",
+    )
+    parser.add_argument(
+        "--num_producers",
+        default=1,
+        type=int,
+        help="Number of processes reading the training data in parallel",
+    )
     parser.add_argument("--debug", default=False, action="store_true", help="Debug mode")
     parser.add_argument(
         "--no_verbose",
@@ -739,6 +1104,7 @@ if __name__ == "__main__":
             consecutive_spaces=args.consecutive_spaces,
             consecutive_tabs=args.consecutive_tabs,
             consecutive_linebreaks=args.consecutive_linebreaks,
+            num_producers=args.num_producers,
         )
         tok.save_pretrained(args.output)
 
@@ -764,14 +1130,24 @@ if __name__ == "__main__":
             tokens = [t[0] for t in tokens]
             print(tokens)
 
+        word_counts = None
+        if args.word_counts:
+            if not word_counts_filenames(args.word_counts):
+                print(f"Count words in {args.word_counts}")
+                compute_word_counts(tok, trainset, args.word_counts, num_processes=args.num_producers)
+            word_counts = load_word_counts(args.word_counts, tok, trainset)
+            print(f"Loaded {len(word_counts[0])} distinct words ({sum(word_counts[1])} words) from {args.word_counts}")
+
         tok = fit_tokenizer(
             tok,
             trainset,
+            word_counts=word_counts,
             vocab_size=args.vocab_size,
             consecutive_spaces=args.consecutive_spaces,
             consecutive_tabs=args.consecutive_tabs,
             consecutive_linebreaks=args.consecutive_linebreaks,
             enforce_alphabet=args.enforce_alphabet,
+            num_producers=args.num_producers,
         )
         tok.save(os.path.join(args.output, "tokenizer.json"))
         tok = transformers.PreTrainedTokenizerFast(tokenizer_file=os.path.join(args.output, "tokenizer.json"))
@@ -1,13 +1,21 @@
 import argparse
+import contextlib
+import itertools
+import json
+import re
+import urllib.parse
 
+import numpy as np
 from datatrove.data import Document, DocumentsPipeline
-from datatrove.executor import SlurmPipelineExecutor
 from datatrove.pipeline.filters import URLFilter
-from datatrove.pipeline.filters.base_filter import BaseFilter
+from datatrove.pipeline.filters.base_filter import BaseFilter, get_filter_result
 from datatrove.pipeline.formatters import PIIFormatter
 from datatrove.pipeline.readers import HuggingFaceDatasetReader
 from datatrove.pipeline.writers import ParquetWriter
 from datatrove.pipeline.writers.disk_base import DiskWriter
+from datatrove.utils.typeshelper import StatHints
+from domain_index import find_domains_file, load_domains
+from executors import add_config_arguments, get_executor, load_config
 
 
 def extract_url(data: DocumentsPipeline, rank: int = 0, world_size: int = 1) -> DocumentsPipeline:
@@ -15,123 +23,300 @@ def extract_url(data: DocumentsPipeline, rank: int = 0, world_size: int = 1) ->
     `data` is a generator of Document. You must also return a generator of Document (yield)
     You can optionally use `rank` and `world_size` for sharding
     """
-    import json
-
     for document in data:
         document.metadata["url"] = json.loads(document.metadata["meta"])["url"]
         yield document
 
 
+class QualitySignals:
+    """
+    The RedPajama quality signals used by the filters below, decoded once per document (see get_quality_signals).
+
+    Attributes have the names of the signals, and contain the document-level value
+    (for "rps_lines_start_with_bulletpoint", the number of lines starting with a bullet point).
+    """
+
+    # Signals with a document-level value (signals[name][0][2])
+    DOC_SIGNALS = (
+        "ccnet_perplexity",
+        "ccnet_language_score",
+        "ccnet_nlines",
+        "rps_doc_num_sentences",
+        "rps_doc_curly_bracket",
+        "rps_doc_lorem_ipsum",
+        "rps_doc_ldnoobw_words",
+        "rps_doc_word_count",
+        "rps_doc_mean_word_length",
+        "rps_doc_symbol_to_word_ratio",
+        "rps_doc_frac_lines_end_with_ellipsis",
+        "rps_doc_frac_no_alph_words",
+        "rps_doc_frac_chars_top_2gram",
+        "rps_doc_frac_chars_top_3gram",
+        "rps_doc_frac_chars_top_4gram",
+        "rps_doc_frac_chars_dupe_5grams",
+        "rps_doc_frac_chars_dupe_6grams",
+        "rps_doc_frac_chars_dupe_7grams",
+        "rps_doc_frac_chars_dupe_8grams",
+        "rps_doc_frac_chars_dupe_9grams",
+        "rps_doc_frac_chars_dupe_10grams",
+        "rps_doc_ut1_blacklist",
+    )
+
+    # Signals with a numerical value, also gathered in the tuple `values` (to build columns of a batch of documents)
+    NUMERIC_SIGNALS = tuple(name for name in DOC_SIGNALS if name != "rps_doc_ut1_blacklist") + (
+        "rps_lines_start_with_bulletpoint",
+    )
+
+    __slots__ = DOC_SIGNALS + ("rps_lines_start_with_bulletpoint", "is_duplicate", "values")
+
+    def __init__(self, signals: dict):
+        for name in self.DOC_SIGNALS:
+            setattr(self, name, signals[name][0][2])
+        self.rps_lines_start_with_bulletpoint = sum(line[2] for line in signals["rps_lines_start_with_bulletpoint"])
+        self.is_duplicate = signals["is_duplicate"]
+        self.values = tuple(getattr(self, name) for name in self.NUMERIC_SIGNALS)
+
+
+def get_quality_signals(doc: Document) -> QualitySignals:
+    """
+    Return the quality signals of a document, decoding the json in doc.metadata["quality_signals"] only once.
+
+    Signals are kept as an attribute of the document (not in its metadata, that is written by writers),
+    and only decoded when a filter needs them (not for documents that were removed before).
+    """
+    signals = getattr(doc, "quality_signals", None)
+    if signals is None:
+        signals = QualitySignals(json.loads(doc.metadata["quality_signals"]))
+        doc.quality_signals = signals
+    return signals
+
+
+# Rules of RedPajamaQualityFilter, as (signal, operator, threshold, label):
+# a document is removed, with the label of the first rule whose condition is true (ex: perplexity < 10).
+# Signals are attributes of QualitySignals, or "frac_lines_start_with_bulletpoint"
+# (number of lines starting with a bullet point divided by the number of lines).
+REDPAJAMA_QUALITY_RULES = [
+    ### Lucie
+    # rule 1: ppl between 10 and 1000
+    ("ccnet_perplexity", "<", 10, "ccnet:perplexity"),
+    ("ccnet_perplexity", ">", 1000, "ccnet:perplexity"),
+    # rule 2: confidence in language > 0.65
+    ("ccnet_language_score", "<", 0.65, "ccnet:language_score"),
+    ### C4
+    # rule: at least 3 sentences
+    ("rps_doc_num_sentences", "<", 3, "C4:num_sentences"),
+    # rule: ratio between the number of occurrences of '{' or '}' and the number of characters in the raw text.
+    ("rps_doc_curly_bracket", ">", 0, "C4:curly_bracket"),
+    # rule: page may not contain placeholder "lorem ipsum" text
+    ("rps_doc_lorem_ipsum", ">", 0, "C4:lorem_ipsum"),
+    # TOXICITY
+    # rule : page may not contain bad words in bad url
+    ("rps_doc_ldnoobw_words", ">", 0, "C4:toxic_words"),
+    ### Gopher
+    # rule: number of words between 50 and 10'000
+    ("rps_doc_word_count", "<", 50, "Gopher:word_count"),
+    ("rps_doc_word_count", ">", 100_000, "Gopher:word_count"),
+    # rule: mean word length between 3 and 10
+    ("rps_doc_mean_word_length", "<", 3, "Gopher:mean_word_length"),
+    ("rps_doc_mean_word_length", ">", 10, "Gopher:mean_word_length"),
+    # rule: symbol to word ratio below 0.1
+    ("rps_doc_symbol_to_word_ratio", ">", 0.1, "Gopher:symbol_word_ratio"),
+    # rule: 90% of lines need to start without a bullet point
+    ("frac_lines_start_with_bulletpoint", ">", 0.9, "Gopher:bulletpoint_start"),
+    # rule: more than 30% ending with an ellipsis
+    ("rps_doc_frac_lines_end_with_ellipsis", ">", 0.3, "Gopher:lines_end_with_ellipsis_ratio"),
+    # rule: 70% of words in a document contain at least one alphabetic character
+    ("rps_doc_frac_no_alph_words", ">", 0.3, "Gopher_bis:rps_doc_frac_no_alph_words"),
+    # Gopher repetition removal
+    ("rps_doc_frac_chars_top_2gram", ">", 0.2, "Gopher:rps_doc_frac_chars_top_2gram"),
+    ("rps_doc_frac_chars_top_3gram", ">", 0.18, "Gopher:rps_doc_frac_chars_top_3gram"),
+    ("rps_doc_frac_chars_top_4gram", ">", 0.16, "Gopher:rps_doc_frac_chars_top_4gram"),
+    ("rps_doc_frac_chars_dupe_5grams", ">", 0.15, "Gopher:rps_doc_frac_chars_dupe_5grams"),
+    ("rps_doc_frac_chars_dupe_6grams", ">", 0.14, "Gopher:rps_doc_frac_chars_dupe_6grams"),
+    ("rps_doc_frac_chars_dupe_7grams", ">", 0.13, "Gopher:rps_doc_frac_chars_dupe_7grams"),
+    ("rps_doc_frac_chars_dupe_8grams", ">", 0.12, "Gopher:rps_doc_frac_chars_dupe_8grams"),
+    ("rps_doc_frac_chars_dupe_9grams", ">", 0.11, "Gopher:rps_doc_frac_chars_dupe_9grams"),
+    ("rps_doc_frac_chars_dupe_10grams", ">", 0.10, "Gopher:rps_doc_frac_chars_dupe_10grams"),
+]
+
+_RULE_OPERATORS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+
+def load_quality_rules(rules=None) -> list[tuple[str, str, float, str]]:
+    """
+    Return a list of rules (signal, operator, threshold, label), checking them.
+
+    :param rules: a list of rules, the name of a json file with a list of rules,
+        or None for the default rules (REDPAJAMA_QUALITY_RULES)
+    """
+    if rules is None:
+        rules = REDPAJAMA_QUALITY_RULES
+    elif isinstance(rules, str):
+        with open(rules, encoding="utf8") as f:
+            rules = json.load(f)
+    checked_rules = []
+    for rule in rules:
+        field, op, threshold, label = rule
+        if field not in QualitySignals.NUMERIC_SIGNALS and field != "frac_lines_start_with_bulletpoint":
+            raise ValueError(f"Unknown quality signal {field} in rule {rule}")
+        if op not in _RULE_OPERATORS:
+            raise ValueError(f"Unknown operator {op} in rule {rule} (expected one of {list(_RULE_OPERATORS)})")
+        checked_rules.append((field, op, float(threshold), label))
+    return checked_rules
+
+
+def batched(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 class RedPajamaQualityFilter(BaseFilter):
+    """
+    Remove documents according to a table of rules on their RedPajama quality signals (see REDPAJAMA_QUALITY_RULES).
+
+    Documents are filtered by batches of `batch_size`:
+    the signals of a batch are gathered in numpy columns, and all the rules are evaluated on whole columns.
+    """
+
     name = "🔴🦙 RedPajama Quality"
 
     def __init__(
         self,
         exclusion_writer: DiskWriter = None,
         language: str = "fr",
+        rules: list | str = None,
+        batch_size: int = 1000,
     ):
+        """
+        :param rules: list of rules (signal, operator, threshold, label), or name of a json file with such a list
+            (default: REDPAJAMA_QUALITY_RULES)
+        :param batch_size: number of documents filtered at once
+        """
         super().__init__(exclusion_writer)
         self.language = language
+        self.rules = load_quality_rules(rules)
+        self.batch_size = max(1, batch_size)
+
+    def signal_columns(self, batch: list[Document]) -> dict[str, np.ndarray]:
+        """
+        Return a dictionary {signal: column of values} for a batch of documents.
+        """
+        num_signals = len(QualitySignals.NUMERIC_SIGNALS)
+        values = np.fromiter(
+            itertools.chain.from_iterable(get_quality_signals(doc).values for doc in batch),
+            dtype=np.float64,
+            count=len(batch) * num_signals,
+        ).reshape(len(batch), num_signals)
+        columns = dict(zip(QualitySignals.NUMERIC_SIGNALS, values.T))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            columns["frac_lines_start_with_bulletpoint"] = (
+                columns["rps_lines_start_with_bulletpoint"] / columns["ccnet_nlines"]
+            )
+        return columns
+
+    def filter_batch(self, batch: list[Document]) -> list[bool | tuple[bool, str]]:
+        """
+        Filter a batch of documents: return, for each document, True if it is kept,
+        or (False, label of the first rule that removes it).
+        """
+        if not self.rules:
+            return [True] * len(batch)
+        columns = self.signal_columns(batch)
+        failed = np.stack([_RULE_OPERATORS[op](columns[field], threshold) for field, op, threshold, _ in self.rules])
+        keep = ~failed.any(axis=0)
+        first_failed = failed.argmax(axis=0)
+        return [
+            True if kept else (False, self.rules[rule][3]) for kept, rule in zip(keep.tolist(), first_failed.tolist())
+        ]
 
-    def filter(self, doc: Document) -> bool | tuple[bool, str]:  # noqa # C901
-        import json
-
-        signals = json.loads(doc.metadata["quality_signals"])
-
-        ### Lucie
-        # rule 1: ppl between 10 and 1000
-        perplexity = signals["ccnet_perplexity"][0][2]
-        if perplexity < 10 or perplexity > 1000:
-            return False, "ccnet:perplexity"
-
-        # rule 2: confidence in language > 0.65
-        language_score = signals["ccnet_language_score"][0][2]
-        if language_score < 0.65:
-            return False, "ccnet:language_score"
-
-        ### C4
-        # rule: at least 3 sentences
-        num_sentences = signals["rps_doc_num_sentences"][0][2]
-        if num_sentences < 3:
-            return False, "C4:num_sentences"
-
-        # rule: ratio between the number of occurrences of '{' or '}' and the number of characters in the raw text.
-        doc_curly_bracket = signals["rps_doc_curly_bracket"][0][2]
-        if doc_curly_bracket > 0:
-            return False, "C4:curly_bracket"
-
-        # rule: page may not contain placeholder "lorem ipsum" text
-        lorem_ipsum = signals["rps_doc_lorem_ipsum"][0][2]
-        if lorem_ipsum > 0:
-            return False, "C4:lorem_ipsum"
-
-        # TOXICITY
-        # rule : page may not contain bad words in bad url
-        n_bad_words = signals["rps_doc_ldnoobw_words"][0][2]
-        if n_bad_words > 0:
-            return False, "C4:toxic_words"
-
-        ### Gopher
-        # rule: number of words between 50 and 10'000
-        word_count = signals["rps_doc_word_count"][0][2]
-        if word_count < 50 or word_count > 100_000:
-            return False, "Gopher:word_count"
-
-        # rule: mean word length between 3 and 10
-        mean_word_length = signals["rps_doc_mean_word_length"][0][2]
-        if mean_word_length < 3 or mean_word_length > 10:
-            return False, "Gopher:mean_word_length"
-
-        # rule: symbol to word ratio below 0.1
-        symbol_word_ratio = signals["rps_doc_symbol_to_word_ratio"][0][2]
-        if symbol_word_ratio > 0.1:
-            return False, "Gopher:symbol_word_ratio"
-
-        # rule: 90% of lines need to start without a bullet point
-        n_lines = signals["ccnet_nlines"][0][2]
-        n_lines_bulletpoint_start = sum(map(lambda ln: ln[2], signals["rps_lines_start_with_bulletpoint"]))
-        if n_lines_bulletpoint_start / n_lines > 0.9:
-            return False, "Gopher:bulletpoint_start"
-
-        # rule: more than 30% ending with an ellipsis
-        lines_end_with_ellipsis_ratio = signals["rps_doc_frac_lines_end_with_ellipsis"][0][2]
-        if lines_end_with_ellipsis_ratio > 0.3:
-            return False, "Gopher:lines_end_with_ellipsis_ratio"
-
-        # rule: 70% of words in a document contain at least one alphabetic character
-        rps_doc_frac_no_alph_words = signals["rps_doc_frac_no_alph_words"][0][2]
-        if rps_doc_frac_no_alph_words > 0.3:
-            return False, "Gopher_bis:rps_doc_frac_no_alph_words"
-
-        # Gopher repetition removal
-        rps_doc_frac_chars_top_2gram = signals["rps_doc_frac_chars_top_2gram"][0][2]
-        rps_doc_frac_chars_top_3gram = signals["rps_doc_frac_chars_top_3gram"][0][2]
-        rps_doc_frac_chars_top_4gram = signals["rps_doc_frac_chars_top_4gram"][0][2]
-        rps_doc_frac_chars_dupe_5grams = signals["rps_doc_frac_chars_dupe_5grams"][0][2]
-        rps_doc_frac_chars_dupe_6grams = signals["rps_doc_frac_chars_dupe_6grams"][0][2]
-        rps_doc_frac_chars_dupe_7grams = signals["rps_doc_frac_chars_dupe_7grams"][0][2]
-        rps_doc_frac_chars_dupe_8grams = signals["rps_doc_frac_chars_dupe_8grams"][0][2]
-        rps_doc_frac_chars_dupe_9grams = signals["rps_doc_frac_chars_dupe_9grams"][0][2]
-        rps_doc_frac_chars_dupe_10grams = signals["rps_doc_frac_chars_dupe_10grams"][0][2]
-        if rps_doc_frac_chars_top_2gram > 0.2:
-            return False, "Gopher:rps_doc_frac_chars_top_2gram"
-        if rps_doc_frac_chars_top_3gram > 0.18:
-            return False, "Gopher:rps_doc_frac_chars_top_3gram"
-        if rps_doc_frac_chars_top_4gram > 0.16:
-            return False, "Gopher:rps_doc_frac_chars_top_4gram"
-        if rps_doc_frac_chars_dupe_5grams > 0.15:
-            return False, "Gopher:rps_doc_frac_chars_dupe_5grams"
-        if rps_doc_frac_chars_dupe_6grams > 0.14:
-            return False, "Gopher:rps_doc_frac_chars_dupe_6grams"
-        if rps_doc_frac_chars_dupe_7grams > 0.13:
-            return False, "Gopher:rps_doc_frac_chars_dupe_7grams"
-        if rps_doc_frac_chars_dupe_8grams > 0.12:
-            return False, "Gopher:rps_doc_frac_chars_dupe_8grams"
-        if rps_doc_frac_chars_dupe_9grams > 0.11:
-            return False, "Gopher:rps_doc_frac_chars_dupe_9grams"
-        if rps_doc_frac_chars_dupe_10grams > 0.10:
-            return False, "Gopher:rps_doc_frac_chars_dupe_10grams"
-        return True
+    def filter(self, doc: Document) -> bool | tuple[bool, str]:
+        return self.filter_batch([doc])[0]
+
+    def run(self, data: DocumentsPipeline, rank: int = 0, world_size: int = 1) -> DocumentsPipeline:
+        # Same as BaseFilter.run, with documents filtered by batches
+        with self.exclusion_writer if self.exclusion_writer else contextlib.nullcontext() as writer:
+            for batch in batched(data, self.batch_size):
+                with self.track_time("batch"):
+                    results = self.filter_batch(batch)
+                for doc, result in zip(batch, results):
+                    self.stat_update(StatHints.total)
+                    filter_result, reason = get_filter_result(result)
+                    if filter_result:
+                        self.stat_update(StatHints.forwarded)
+                        self.update_doc_stats(doc)
+                    else:
+                        self.stat_update(StatHints.dropped)
+                        if reason:
+                            self.stat_update(f"dropped_{reason}")
+                        if self.exclusion_writer:
+                            if reason:
+                                doc.metadata["filter_reason"] = reason
+                            writer.write(doc, rank)
+                        continue
+                    yield doc
+
+
+# Sources of URLs already in other datasets, by language (a URL containing one of these is removed)
+DEDUP_URL_KEYWORDS = {
+    "fr": ("fr.wikipedia", "wiktionary", "wikisource", "theses.fr"),
+    "en": (
+        "en.wikipedia",
+        "arxiv.org",
+        "www.ncbi.nlm.nih.gov/pmc",
+        "philpapers.org",
+        "exporter.nih.gov",
+        "irclogs.ubuntu.com",
+        "courtlistener.com",
+        "uspto.gov",
+    ),
+}
+DEFAULT_DEDUP_URL_KEYWORDS = ("wikipedia", "europarl", "op.europa.eu")
+
+_EXTRA_SLASHES = re.compile(r"://+")
+# Scheme, slashes (possibly extra ones), and network location followed by the end of the URL or by one of "/?#"
+# (URLs with tabs or new lines, brackets, or spaces at the beginning are left to urllib.parse)
+_URL_NETLOC = re.compile(r"[A-Za-z][A-Za-z0-9+.\-]*://+(?!/)([^/?#\t\r\n\[\]]*)(?=[/?#]|\Z)")
+
+
+def canonical_domain(url: str) -> str:
+    """
+    Return the (lower case) network location of a URL, tolerating extra slashes after the scheme.
+    """
+    # Fast path for usual URLs (same result as urllib.parse.urlsplit)
+    match = _URL_NETLOC.match(url)
+    if match:
+        domain = match.group(1)
+        if domain.isascii():
+            return domain.lower()
+    domain = urllib.parse.urlsplit(url).netloc.lower()
+    if not domain and url.strip():
+        # extra //
+        domain = urllib.parse.urlsplit(_EXTRA_SLASHES.sub("://", url)).netloc.lower()
+    return domain
+
+
+def get_url_domain(doc: Document) -> str:
+    """
+    Return the domain of the URL of a document, parsing the URL only once (see get_quality_signals).
+    """
+    domain = getattr(doc, "url_domain", None)
+    if domain is None:
+        domain = canonical_domain(doc.metadata["url"])
+        doc.url_domain = domain
+    return domain
 
 
 class LucieURLFilter(BaseFilter):
@@ -144,38 +329,24 @@ class LucieURLFilter(BaseFilter):
     ):
         super().__init__(exclusion_writer)
         self.language = language
+        self.dedup_keywords = DEDUP_URL_KEYWORDS.get(language, DEFAULT_DEDUP_URL_KEYWORDS)
 
-    def filter(self, doc: Document) -> bool | tuple[bool, str]:
-        import json
-
-        signals = json.loads(doc.metadata["quality_signals"])
+    def dedup_source(self, url: str) -> str | None:
+        """
+        Return the keyword of a source of URLs already in other datasets that the URL contains, or None.
+        """
+        for keyword in self.dedup_keywords:
+            if keyword in url:
+                return keyword
+        return None
 
+    def filter(self, doc: Document) -> bool | tuple[bool, str]:
         # rule: url that are already in the other datasets
-        def is_url_duplicated(url, language):
-            if language == "fr":
-                keywords = ["fr.wikipedia", "wiktionary", "wikisource", "theses.fr"]
-            elif language == "en":
-                keywords = [
-                    "en.wikipedia",
-                    "arxiv.org",
-                    "www.ncbi.nlm.nih.gov/pmc",
-                    "philpapers.org",
-                    "exporter.nih.gov",
-                    "irclogs.ubuntu.com",
-                    "courtlistener.com",
-                    "uspto.gov",
-                ]
-            else:
-                keywords = ["wikipedia", "europarl", "op.europa.eu"]
-            return any(keyword in url for keyword in keywords)
-
-        url = doc.metadata["url"]
-        url_dedup = is_url_duplicated(url, self.language)
-        if url_dedup:
+        if self.dedup_source(doc.metadata["url"]) is not None:
             return False, "lucie:dedup_url"
 
         # rule: url blacklist
-        rps_doc_ut1_blacklist = signals["rps_doc_ut1_blacklist"][0][2]
+        rps_doc_ut1_blacklist = get_quality_signals(doc).rps_doc_ut1_blacklist
         # https://data.together.xyz/redpajama-data-v2/v1.0.0/artifacts/ut1_domain_categories.json
         if rps_doc_ut1_blacklist is not None:
             return False, "lucie:blacklist_url"
@@ -192,12 +363,8 @@ class RedPajamaDuplicatesFilter(BaseFilter):
         super().__init__(exclusion_writer)
 
     def filter(self, doc: Document) -> bool | tuple[bool, str]:
-        import json
-
-        signals = json.loads(doc.metadata["quality_signals"])
-
         # Remove duplicates
-        if signals["is_duplicate"]:
+        if get_quality_signals(doc).is_duplicate:
             return False, "duplicates"
         return True
 
@@ -216,28 +383,13 @@ class CanFetchFilter(BaseFilter):
 
     @property
     def valid_domains(self):
-        import json
-
+        # Index of domains (.npy, memory-mapped) or json list of domains
         if self._valid_domains is None:
-            with open(self.file_path) as fp:
-                self._valid_domains = set(json.load(fp))
+            self._valid_domains = load_domains(self.file_path)
         return self._valid_domains
 
-    def filter(self, doc: Document) -> bool | tuple[bool, str]:  # noqa # C901
-        import re
-        import urllib.parse
-
-        def canonical_url(url):
-            url_base = urllib.parse.urlparse(url).netloc.lower()
-            if not url_base and url.strip():
-                # extra //
-                url = re.sub(r"://+", "://", url)
-                url_base = urllib.parse.urlparse(url).netloc.lower()
-            return url_base
-
-        url = doc.metadata["url"]
-        domain = canonical_url(url)
-        if domain in self.valid_domains:
+    def filter(self, doc: Document) -> bool | tuple[bool, str]:
+        if get_url_domain(doc) in self.valid_domains:
             return True
         else:
             return False, "Cannot fetch this domain"
@@ -254,24 +406,49 @@ def get_args():
     parser.add_argument(
         "--main-output-path",
         type=str,
-        default="/lustre/fsn1/projects/rech/qgz/uzq54wg/processed_redpajama",
-        help="Specify the main output path. Default is '/lustre/fsn1/projects/rech/qgz/uzq54wg/processed_redpajama'.",
+        default=None,
+        help="Specify the main output path. Default is the one of the config.",
     )
 
     parser.add_argument("--dataset-name", type=str, default="togethercomputer/RedPajama-Data-V2", help="")
+    parser.add_argument(
+        "--valid-domains",
+        type=str,
+        default=None,
+        help="Json file with the list of domains that can be fetched. Default is the one of the config.",
+    )
+    parser.add_argument(
+        "--valid-domains-index",
+        type=str,
+        default=None,
+        help="Index (.npy) of the valid domains, built if it does not exist or is older than the json file."
+        " Default is the index next to the json file if it is up to date (see domain_index.py), else the json file.",
+    )
+    parser.add_argument(
+        "--quality-rules",
+        type=str,
+        default=None,
+        help="Json file with a list of rules [signal, operator, threshold, label] for the RedPajama quality filter."
+        " Default is REDPAJAMA_QUALITY_RULES.",
+    )
+    add_config_arguments(parser)
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = get_args()
+    config = load_config(args.config, executor=args.executor, workers=args.workers)
 
     DATASET_NAME = args.dataset_name
     DUMP_TO_PROCESS = args.dump_to_process
     LANGUAGE = args.language
-    MAIN_OUTPUT_PATH = args.main_output_path
+    MAIN_OUTPUT_PATH = args.main_output_path or config["main_output_path"]
     FILTERING_OUTPUT_PATH = f"{MAIN_OUTPUT_PATH}/base_processing"
+    VALID_DOMAINS_FILE = find_domains_file(args.valid_domains or config["valid_domains"], args.valid_domains_index)
 
-    main_processing_executor = SlurmPipelineExecutor(
+    main_processing_executor = get_executor(
+        config,
+        "base_processing",
         job_name=f"{DUMP_TO_PROCESS}--{LANGUAGE}",
         pipeline=[
             HuggingFaceDatasetReader(
@@ -286,31 +463,24 @@ if __name__ == "__main__":
                 },
                 streaming=True,
                 text_key="raw_content",
-                # limit=1000 # for debug
+                limit=args.limit,
             ),
             extract_url,
             URLFilter(),
             LucieURLFilter(
                 language=LANGUAGE,
             ),
-            CanFetchFilter(file_path="/lustre/fsn1/projects/rech/qgz/uzq54wg/valid_domains_redpajama_4500k.json"),
+            CanFetchFilter(file_path=VALID_DOMAINS_FILE),
             RedPajamaQualityFilter(
                 language=LANGUAGE,
+                rules=args.quality_rules,
             ),
             RedPajamaDuplicatesFilter(),
             PIIFormatter(email_replacement="<email>", ip_replacement="<ip>"),
             ParquetWriter(f"{FILTERING_OUTPUT_PATH}/output/{LANGUAGE}/{DUMP_TO_PROCESS}"),
         ],
-        sbatch_args={"account": "qgz@cpu"},
-        tasks=50,  # => 2 minutes
-        cpus_per_task=2,
-        time="5:00:00",
         logging_dir=f"{MAIN_OUTPUT_PATH}/logs/base_processing/{LANGUAGE}/{DUMP_TO_PROCESS}",
         slurm_logs_folder=f"logs/base_processing/{LANGUAGE}/{DUMP_TO_PROCESS}",  # must be local
-        randomize_start_duration=180,  # don't hit the bucket all at once with the list requests
-        qos="qos_cpu-t3",
-        partition="cpu_p1",
-        condaenv="/lustre/fsn1/projects/rech/qgz/uzq54wg/envs/datatrove",
     )
 
     main_processing_executor.run()
@@ -0,0 +1,120 @@
+"""
+Micro-benchmark of the URL rules of base.py (LucieURLFilter and CanFetchFilter) on a list of URLs,
+compared to their former implementation (keyword lists re-created for each document, URLs parsed by each filter).
+
+URLs are read from text files (one URL per line), or from parquet files with a "url" column
+(ex: outputs of base.py, where it is in the metadata).
+
+Example:
+    python benchmark_url_filters.py urls.txt --limit 1000000 --valid-domains valid_domains_redpajama_4500k.json
+"""
+
+import argparse
+import json
+import re
+import time
+import urllib.parse
+
+from base import DEDUP_URL_KEYWORDS, DEFAULT_DEDUP_URL_KEYWORDS, canonical_domain
+
+
+def read_urls(filenames, limit=None):
+    urls = []
+    for filename in filenames:
+        if filename.endswith(".parquet"):
+            import pyarrow.parquet as pq
+
+            schema = pq.read_schema(filename)
+            column = "url" if "url" in schema.names else "metadata"
+            for value in pq.read_table(filename, columns=[column]).column(column).to_pylist():
+                urls.append(value if column == "url" else value["url"])
+        else:
+            with open(filename, encoding="utf8") as f:
+                urls.extend(line.rstrip("\n") for line in f)
+        if limit and len(urls) >= limit:
+            return urls[:limit]
+    return urls
+
+
+def former_is_url_duplicated(url, language):
+    if language == "fr":
+        keywords = ["fr.wikipedia", "wiktionary", "wikisource", "theses.fr"]
+    elif language == "en":
+        keywords = [
+            "en.wikipedia",
+            "arxiv.org",
+            "www.ncbi.nlm.nih.gov/pmc",
+            "philpapers.org",
+            "exporter.nih.gov",
+            "irclogs.ubuntu.com",
+            "courtlistener.com",
+            "uspto.gov",
+        ]
+    else:
+        keywords = ["wikipedia", "europarl", "op.europa.eu"]
+    return any(keyword in url for keyword in keywords)
+
+
+def former_canonical_url(url):
+    url_base = urllib.parse.urlparse(url).netloc.lower()
+    if not url_base and url.strip():
+        # extra //
+        url = re.sub(r"://+", "://", url)
+        url_base = urllib.parse.urlparse(url).netloc.lower()
+    return url_base
+
+
+def dedup_source(url, keywords):
+    for keyword in keywords:
+        if keyword in url:
+            return keyword
+    return None
+
+
+def timeit(name, function, urls, results):
+    tic = time.perf_counter()
+    output = [function(url) for url in urls]
+    duration = time.perf_counter() - tic
+    results[name] = duration
+    print(f"{name:<30} {duration:7.3f}s  {len(urls) / duration / 1e6:6.2f} M URLs/s")
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark URL rules of the base processing",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("inputs", type=str, nargs="+", help="Text files (one URL per line) or parquet files")
+    parser.add_argument("--limit", type=int, default=1_000_000, help="Maximum number of URLs")
+    parser.add_argument("--language", type=str, default="fr", help="Language of the dedup rule")
+    parser.add_argument("--valid-domains", type=str, default=None, help="Json file of domains that can be fetched")
+    args = parser.parse_args()
+
+    urls = read_urls(args.inputs, args.limit)
+    print(f"{len(urls)} URLs")
+    keywords = DEDUP_URL_KEYWORDS.get(args.language, DEFAULT_DEDUP_URL_KEYWORDS)
+    valid_domains = set()
+    if args.valid_domains:
+        with open(args.valid_domains) as f:
+            valid_domains = set(json.load(f))
+
+    results = {}
+    former_dedup = timeit("dedup (former)", lambda url: former_is_url_duplicated(url, args.language), urls, results)
+    dedup = timeit("dedup", lambda url: dedup_source(url, keywords), urls, results)
+    assert former_dedup == [source is not None for source in dedup]
+
+    former_domains = timeit("domain (former)", former_canonical_url, urls, results)
+    domains = timeit("domain", canonical_domain, urls, results)
+    assert former_domains == domains
+
+    def former_all(url):
+        return not former_is_url_duplicated(url, args.language) and former_canonical_url(url) in valid_domains
+
+    def new_all(url):
+        return dedup_source(url, keywords) is None and canonical_domain(url) in valid_domains
+
+    former_kept = timeit("dedup + can fetch (former)", former_all, urls, results)
+    kept = timeit("dedup + can fetch", new_all, urls, results)
+    assert former_kept == kept
+    print(f"{sum(kept)} URLs kept, speedup {results['dedup + can fetch (former)'] / results['dedup + can fetch']:.2f}x")
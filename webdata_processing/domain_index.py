@@ -0,0 +1,124 @@
+"""
+Compact on-disk index of a set of domains (ex: the domains whose robots.txt allows fetching, see CanFetchFilter).
+
+The index is a sorted array of 64-bit hashes of the domains, saved as a .npy file (8 bytes per domain).
+It is memory-mapped when loaded, so that all the tasks on a node share the same pages,
+and a domain is looked up by binary search on its hash.
+With 64-bit hashes, the probability that a domain not in the set is found in an index of 5M domains is ~3e-13.
+
+To build an index from a json list of domains (ex: valid_domains.json written by extract_robot_file/postprocess.py):
+    python domain_index.py valid_domains.json
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def domain_hash(domain: str) -> int:
+    """
+    Return a 64-bit hash of a domain, stable across processes and machines.
+    """
+    return int.from_bytes(hashlib.blake2b(domain.encode("utf8"), digest_size=8).digest(), "little")
+
+
+def build_domain_index(domains, filename: str) -> int:
+    """
+    Write the index of an iterable of domains into a .npy file, and return the number of distinct domains.
+    """
+    hashes = np.unique(np.fromiter(map(domain_hash, domains), dtype=np.uint64))
+    os.makedirs(os.path.dirname(os.path.realpath(filename)), exist_ok=True)
+    # (temporary file specific to this process, in case several processes build the same index)
+    tmp_filename = f"{filename}.tmp{os.getpid()}.npy"
+    np.save(tmp_filename, hashes)
+    os.replace(tmp_filename, filename)
+    return len(hashes)
+
+
+def index_filename(json_filename: str) -> str:
+    """
+    Return the name of the index of a json list of domains.
+    """
+    return os.path.splitext(json_filename)[0] + ".npy"
+
+
+def is_up_to_date(filename: str, json_filename: str) -> bool:
+    """
+    Return whether an index exists and is not older than the json list of domains it was built from.
+    """
+    return os.path.isfile(filename) and os.path.getmtime(filename) >= os.path.getmtime(json_filename)
+
+
+def find_domains_file(json_filename: str, filename: str | None = None) -> str:
+    """
+    Return the file from which to load a json list of domains (see load_domains).
+
+    :param filename: index to use, built if it does not exist (or is older than the json file).
+        If None, the index next to the json file is used if it is up to date (ex: built by postprocess.py),
+        and the json file otherwise (it is never written next to the json file, which may not be writable).
+    """
+    if filename is None:
+        filename = index_filename(json_filename)
+        if is_up_to_date(filename, json_filename):
+            return filename
+        print(f"No up to date index of {json_filename} (see domain_index.py): domains are loaded from the json file")
+        return json_filename
+    if not is_up_to_date(filename, json_filename):
+        with open(json_filename) as fp:
+            build_domain_index(json.load(fp), filename)
+    return filename
+
+
+class DomainIndex:
+    """
+    Set of domains, read from an index written by build_domain_index (memory-mapped).
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        # (plain array view of the memory map, faster to search)
+        self.hashes = np.asarray(np.load(filename, mmap_mode="r"))
+        self.size = len(self.hashes)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, domain: str) -> bool:
+        h = np.uint64(domain_hash(domain))
+        i = self.hashes.searchsorted(h)
+        return i < self.size and bool(self.hashes[i] == h)
+
+
+def load_domains(filename: str):
+    """
+    Return a set of domains (supporting `in`) from an index (.npy) or a json list of domains.
+    """
+    if filename.endswith(".npy"):
+        return DomainIndex(filename)
+    with open(filename) as fp:
+        return set(json.load(fp))
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description="Build the index of a json list of domains",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("input", type=str, help="Json file with a list of domains")
+    parser.add_argument("output", type=str, nargs="?", default=None, help="Index file (default: input with .npy)")
+    args = parser.parse_args()
+
+    output = args.output or index_filename(args.input)
+    tic = time.time()
+    with open(args.input) as fp:
+        domains = json.load(fp)
+    num_domains = build_domain_index(domains, output)
+    print(
+        f"Wrote {output}: {num_domains} domains ({len(domains)} in {args.input}),"
+        f" {os.path.getsize(output) / 1e6:.1f} MB (in {time.time() - tic:.1f}s)"
+    )
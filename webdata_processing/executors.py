@@ -0,0 +1,103 @@
+"""
+Executors of the datatrove pipelines of this folder (base.py, minhash.py): on Slurm, or with a local pool of processes.
+
+Paths and resources are read from a json config file (see configs/):
+    {
+        "executor": "slurm" or "local",
+        "main_output_path": "...",
+        "valid_domains": "...",                   # (base.py only)
+        "slurm": {...},                           # options of SlurmPipelineExecutor common to all stages
+        "local": {"workers": -1},                 # options of LocalPipelineExecutor common to all stages
+        "stages": {"<stage>": {"tasks": 50, ...}} # options of each stage (Slurm resources, number of tasks...)
+    }
+
+Stages run locally use only the "tasks" of the stage options (and "workers", the number of tasks run at once).
+Stages whose number of tasks is fixed by the pipeline (ex: minhash buckets and clustering) must not set "tasks".
+Statistics of each stage (documents per second...) are written in the logging folder (stats.json).
+"""
+
+import json
+import os
+
+from datatrove.executor import LocalPipelineExecutor, SlurmPipelineExecutor
+
+_folder = os.path.dirname(os.path.realpath(__file__))
+
+DEFAULT_CONFIG_FILE = os.path.join(_folder, "configs", "jean_zay.json")
+EXECUTORS = ["slurm", "local"]
+
+# Options of stages that only make sense on Slurm
+_SLURM_ONLY_OPTIONS = {"time", "cpus_per_task", "mem_per_cpu_gb", "randomize_start_duration", "randomize_start"}
+
+
+def load_config(filename=None, executor=None, workers=None):
+    """
+    Load a config file, overriding the executor and the number of local workers.
+    """
+    with open(filename or DEFAULT_CONFIG_FILE, encoding="utf8") as f:
+        config = json.load(f)
+    if executor:
+        config["executor"] = executor
+    config.setdefault("executor", "slurm")
+    if config["executor"] not in EXECUTORS:
+        raise ValueError(f"Unknown executor {config['executor']} (expected one of {EXECUTORS})")
+    config.setdefault("slurm", {})
+    config.setdefault("local", {})
+    config.setdefault("stages", {})
+    if workers:
+        config["local"]["workers"] = workers
+    return config
+
+
+def add_config_arguments(parser):
+    parser.add_argument(
+        "--config", type=str, default=DEFAULT_CONFIG_FILE, help="Json file with paths and resources of the pipeline."
+    )
+    parser.add_argument(
+        "--executor", type=str, default=None, choices=EXECUTORS, help="Executor (default: the one of the config)."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Number of tasks run at once by the local executor (default: config)."
+    )
+    parser.add_argument(
+        "--limit", type=int, default=-1, help="Maximum number of documents read by each task (ex: for benchmarks)."
+    )
+
+
+def get_executor(config, stage, pipeline, logging_dir, slurm_logs_folder, job_name, depends=None, tasks=None):
+    """
+    Return the executor of a stage of a pipeline.
+
+    :param stage: name of the stage, in config["stages"]
+    :param slurm_logs_folder: (local) folder of the Slurm logs
+    :param tasks: number of tasks required by the stage (if None, the one of the config, or 1)
+    """
+    options = dict(config["stages"].get(stage, {}))
+    if tasks is not None:
+        if options.get("tasks", tasks) != tasks:
+            raise ValueError(f"Stage {stage} runs {tasks} tasks, but {options['tasks']} tasks are set in the config")
+        options["tasks"] = tasks
+    options.setdefault("tasks", 1)
+
+    # Slurm tasks (and local workers) import the modules of this folder (ex: domain_index) when they load the pipeline
+    python_path = os.environ.get("PYTHONPATH", "")
+    if _folder not in python_path.split(os.pathsep):
+        os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [_folder, python_path]))
+
+    if config["executor"] == "local":
+        options = {key: value for key, value in options.items() if key not in _SLURM_ONLY_OPTIONS}
+        return LocalPipelineExecutor(
+            pipeline=pipeline,
+            logging_dir=logging_dir,
+            depends=depends,
+            **{**config["local"], **options},
+        )
+
+    return SlurmPipelineExecutor(
+        job_name=job_name,
+        pipeline=pipeline,
+        logging_dir=logging_dir,
+        slurm_logs_folder=slurm_logs_folder,
+        depends=depends,
+        **{**config["slurm"], **options},
+    )
@@ -1,9 +1,15 @@
 import argparse
 import json
 import os
+import sys
 
 import pandas as pd
 
+_folder = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.dirname(_folder))
+
+from domain_index import build_domain_index, index_filename  # noqa # E402 Module level import not at top of file
+
 
 def get_args():
     parser = argparse.ArgumentParser()
@@ -31,5 +37,10 @@ if __name__ == "__main__":
 
     valid_domains = list(df["domain"])
 
-    with open(os.path.join(args.output_path, "valid_domains.json"), "w") as fp:
+    valid_domains_file = os.path.join(args.output_path, "valid_domains.json")
+    with open(valid_domains_file, "w") as fp:
         json.dump(valid_domains, fp)
+
+    # Index of valid domains, to be memory-mapped by CanFetchFilter (see ../domain_index.py)
+    num_domains = build_domain_index(valid_domains, index_filename(valid_domains_file))
+    print(f"{num_domains} valid domains")
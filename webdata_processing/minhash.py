@@ -1,12 +1,19 @@
+"""
+Deduplication (with MinHash) of the outputs of base.py, in 4 stages: signatures, buckets, clustering, and filtering.
+
+By default, only the filtering stage is run (the ids of the documents to remove must have been computed before).
+With --all-stages, the 4 stages are run, each one waiting for the previous one.
+"""
+
 import argparse
 
 import regex as re
-from datatrove.executor import SlurmPipelineExecutor
 from datatrove.pipeline.dedup import MinhashDedupCluster, MinhashDedupFilter, MinhashDedupSignature
 from datatrove.pipeline.dedup.minhash import MinhashConfig, MinhashDedupBuckets
 from datatrove.pipeline.formatters.base import BaseFormatter
 from datatrove.pipeline.readers import ParquetReader
 from datatrove.pipeline.writers import ParquetWriter
+from executors import add_config_arguments, get_executor, load_config
 
 
 class CorrectPII(BaseFormatter):
@@ -45,19 +52,27 @@ def get_args():
     parser.add_argument(
         "--main-output-path",
         type=str,
-        default="/lustre/fsn1/projects/rech/qgz/uzq54wg/processed_redpajama",
-        help="Specify the main output path. Default is '/lustre/fsn1/projects/rech/qgz/uzq54wg/processed_redpajama'.",
+        default=None,
+        help="Specify the main output path. Default is the one of the config.",
     )
+    parser.add_argument(
+        "--all-stages",
+        default=False,
+        action="store_true",
+        help="Run all the stages (signatures, buckets, clustering, filtering). Default is to run the filtering only.",
+    )
+    add_config_arguments(parser)
 
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = get_args()
+    config = load_config(args.config, executor=args.executor, workers=args.workers)
 
     DUMP_TO_PROCESS = args.dump_to_process
     LANGUAGE = args.language
-    MAIN_OUTPUT_PATH = args.main_output_path
+    MAIN_OUTPUT_PATH = args.main_output_path or config["main_output_path"]
     FILTERING_OUTPUT_PATH = f"{MAIN_OUTPUT_PATH}/base_processing"
 
     minhash_config = MinhashConfig(
@@ -71,15 +86,15 @@ if __name__ == "__main__":
     LOGS_FOLDER = f"{MAIN_OUTPUT_PATH}/logs/minhash"
     LOCAL_LOGS_FOLDER = "logs/minhash"
 
-    TOTAL_TASKS = 50
-
     # this is the original data that we want to deduplicate
     INPUT_READER = ParquetReader(
-        f"{FILTERING_OUTPUT_PATH}/output/{LANGUAGE}/{DUMP_TO_PROCESS}"
+        f"{FILTERING_OUTPUT_PATH}/output/{LANGUAGE}/{DUMP_TO_PROCESS}", limit=args.limit
     )  # this is the output from the first part
 
     # stage 1 computes minhash signatures for each task (each task gets a set of files)
-    stage1 = SlurmPipelineExecutor(
+    stage1 = get_executor(
+        config,
+        "minhash_signatures",
         job_name=f"mh1_{DUMP_TO_PROCESS}--{LANGUAGE}",
         pipeline=[
             INPUT_READER,
@@ -87,18 +102,13 @@ if __name__ == "__main__":
                 output_folder=f"{MINHASH_BASE_PATH}/{LANGUAGE}/{DUMP_TO_PROCESS}/signatures", config=minhash_config
             ),
         ],
-        sbatch_args={"account": "qgz@cpu"},
-        tasks=TOTAL_TASKS,
-        time="5:00:00",
-        qos="qos_cpu-t3",
-        partition="cpu_p1",
-        condaenv="/lustre/fsn1/projects/rech/qgz/uzq54wg/envs/datatrove",
         logging_dir=f"{LOGS_FOLDER}/signatures/{LANGUAGE}/{DUMP_TO_PROCESS}",
         slurm_logs_folder=f"{LOCAL_LOGS_FOLDER}/signatures/{LANGUAGE}/{DUMP_TO_PROCESS}",
-        randomize_start_duration=180,
     )
 
-    stage2 = SlurmPipelineExecutor(
+    stage2 = get_executor(
+        config,
+        "minhash_buckets",
         job_name=f"mh2_{DUMP_TO_PROCESS}--{LANGUAGE}",
         pipeline=[
             MinhashDedupBuckets(
@@ -107,20 +117,15 @@ if __name__ == "__main__":
                 config=minhash_config,
             ),
         ],
-        sbatch_args={"account": "qgz@cpu"},
         tasks=minhash_config.num_buckets * 2,  # the code supports parallelizing each bucket.
-        randomize_start_duration=180,
         logging_dir=f"{LOGS_FOLDER}/buckets/{LANGUAGE}/{DUMP_TO_PROCESS}",
         slurm_logs_folder=f"{LOCAL_LOGS_FOLDER}/buckets/{LANGUAGE}/{DUMP_TO_PROCESS}",
-        qos="qos_cpu-t3",
-        partition="cpu_p1",
-        condaenv="/lustre/fsn1/projects/rech/qgz/uzq54wg/envs/datatrove",
-        time="02:00:00",
-        cpus_per_task=1,  # you can add run more (smaller) tasks if you do not have a lot of memory
         depends=stage1,
     )
 
-    stage3 = SlurmPipelineExecutor(
+    stage3 = get_executor(
+        config,
+        "minhash_clustering",
         job_name=f"mh3_{DUMP_TO_PROCESS}--{LANGUAGE}",
         pipeline=[
             MinhashDedupCluster(
@@ -129,19 +134,15 @@ if __name__ == "__main__":
                 config=minhash_config,
             ),
         ],
-        sbatch_args={"account": "qgz@cpu"},
         tasks=1,  # this step runs on a single task
         logging_dir=f"{LOGS_FOLDER}/clustering/{LANGUAGE}/{DUMP_TO_PROCESS}",
         slurm_logs_folder=f"{LOCAL_LOGS_FOLDER}/clustering/{LANGUAGE}/{DUMP_TO_PROCESS}",
-        qos="qos_cpu-t3",
-        partition="cpu_p1",
-        condaenv="/lustre/fsn1/projects/rech/qgz/uzq54wg/envs/datatrove",
-        time="20:00:00",  # and can also be quite slow. Usually not this slow though
-        cpus_per_task=8,  # if you dedup a full dump, you do need a lot of memory for this one
         depends=stage2,
     )
 
-    stage4 = SlurmPipelineExecutor(
+    stage4 = get_executor(
+        config,
+        "minhash_filtering",
         job_name=f"mh4_{DUMP_TO_PROCESS}--{LANGUAGE}",
         pipeline=[
             INPUT_READER,
@@ -149,16 +150,10 @@ if __name__ == "__main__":
             CorrectPII(),
             ParquetWriter(f"{MINHASH_BASE_PATH}/{LANGUAGE}/{DUMP_TO_PROCESS}/deduped_output"),
         ],
-        sbatch_args={"account": "qgz@cpu"},
-        tasks=TOTAL_TASKS,
         logging_dir=f"{LOGS_FOLDER}/filtering_v2/{LANGUAGE}/{DUMP_TO_PROCESS}",
         slurm_logs_folder=f"{LOCAL_LOGS_FOLDER}/filtering_v2/{LANGUAGE}/{DUMP_TO_PROCESS}",
-        qos="qos_cpu-t3",
-        partition="cpu_p1",
-        cpus_per_task=2,
-        randomize_start_duration=180,  # don't hit the bucket all at once with the list requests
-        condaenv="/lustre/fsn1/projects/rech/qgz/uzq54wg/envs/datatrove",
-        time="1:00:00",
+        # running a stage first runs the stages it depends on
+        depends=stage3 if args.all_stages else None,
     )
 
     # launch dedup pipelines